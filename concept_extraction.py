@@ -1,26 +1,49 @@
-import yaml
+import asyncio
+import copy
+import functools
+import hashlib
+import re
+
 from pocketflow import *
 
 # from semantic_text_splitter import TextSplitter
 from semantic_text_splitter import MarkdownSplitter
 
-from config import CHUNK_MAX_TOKENS
+import structured_output
+from concurrency import BoundedParallelBatchFlow
+from config import (
+    CHUNK_DISCOVERY_CONCURRENCY,
+    CHUNK_MAX_TOKENS,
+    CONCEPT_UPDATE_CONCURRENCY,
+    CONSOLIDATION_MAX_TOKENS,
+    EXTRACTION_MODE,
+)
 from debug import printd
-from llm import call_llm
+from llm import LLMNode
 
 
 # *CONCEPT LIST UPDATE
-class BatchConceptUpdate(BatchFlow):
-    def prep(self, shared):
+class BatchConceptUpdate(BoundedParallelBatchFlow):
+    async def prep_async(self, shared):
         concepts = [
             {"single_present_concept": concept}
-            for concept in shared["present_concepts"]
+            for concept in dict.fromkeys(shared["present_concepts"])
         ]
 
         printd(concepts)
 
+        # *Updates run concurrently, so they are staged and merged in chunk order
+        shared["concept_updates"] = {}
+
         return concepts
 
+    async def post_async(self, shared, prep_res, exec_res):
+        for concept in prep_res:
+            single_present_concept = concept["single_present_concept"]
+            shared["concept_dict"][single_present_concept] = shared["concept_updates"][
+                single_present_concept
+            ]
+
 
 class ConceptUpdateTypeSwitch(Node):
     def prep(self, shared):
@@ -36,14 +59,25 @@ class ConceptUpdateTypeSwitch(Node):
 
 
 # *https://github.com/daveshap/SparsePrimingRepresentations
-class ConceptAdd(Node):
-    def prep(self, shared):
+class ConceptAdd(LLMNode):
+    output_fields = {
+        "analysis": (
+            structured_output.STRING,
+            "detailed step-by-step analysis of chunk (ONE string)",
+        ),
+        "extracted_concept_info": (
+            structured_output.STRING,
+            "extracted info relevant to the target concept (ONE string)",
+        ),
+    }
+
+    async def prep_async(self, shared):
         single_present_concept = self.params["single_present_concept"]
         chunk = self.params["chunk"]
 
         return single_present_concept, chunk
 
-    def exec(self, inputs):
+    async def exec_async(self, inputs):
         single_present_concept, chunk = inputs
         prompt = f"""
 Given chunk of notes:
@@ -55,15 +89,9 @@ Analyse the chunk to pick out which part of the chunk is relevant to the target
 You will then give distilled succinct statements, assertions, associations, concepts, analogies, and metaphors. 
 The idea is to capture as much, conceptually, as possible but with as few words as possible. 
 Write it in a way that makes sense to you, as the future audience will be another language model, not a human.
-Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
-```yaml
-analysis: detailed step-by-step analysis of chunk (ONE string)
-extracted_concept_info: extracted info relevant to the target concept (ONE string)
-```
+{self.output_format()}
         """
-        resp = call_llm(prompt)
-        yaml_str = resp.split("```yaml")[1].split("```")[0].strip()
-        result = yaml.safe_load(yaml_str)
+        result = await self.call_llm_structured(prompt)
 
         assert isinstance(result, dict)
         assert "analysis" in result
@@ -72,23 +100,25 @@ extracted_concept_info: extracted info relevant to the target concept (ONE strin
 
         return result
 
-    def post(self, shared, prep_res, exec_res):
+    async def post_async(self, shared, prep_res, exec_res):
         single_present_concept, chunk = prep_res
 
-        shared["concept_dict"][single_present_concept] = exec_res[
+        shared["concept_updates"][single_present_concept] = exec_res[
             "extracted_concept_info"
         ]
 
 
-class ConceptAppend(Node):
-    def prep(self, shared):
+class ConceptAppend(LLMNode):
+    output_fields = ConceptAdd.output_fields
+
+    async def prep_async(self, shared):
         single_present_concept = self.params["single_present_concept"]
         chunk = self.params["chunk"]
         current_extracted_concept_info = shared["concept_dict"][single_present_concept]
 
         return single_present_concept, chunk, current_extracted_concept_info
 
-    def exec(self, inputs):
+    async def exec_async(self, inputs):
         single_present_concept, chunk, current_extracted_concept_info = inputs
         prompt = f"""
 Given chunk of notes:
@@ -105,15 +135,9 @@ You will then give distilled succinct statements, assertions, associations, conc
 The idea is to capture as much, conceptually, as possible but with as few words as possible. 
 Write it in a way that makes sense to you, as the future audience will be another language model, not a human.
 Ensure that no already present information is appended to the extracted concept info.
-Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
-```yaml
-analysis: detailed step-by-step analysis of chunk (ONE string)
-extracted_concept_info: extracted info relevant to the target concept (ONE string)
-```
+{self.output_format()}
         """
-        resp = call_llm(prompt)
-        yaml_str = resp.split("```yaml")[1].split("```")[0].strip()
-        result = yaml.safe_load(yaml_str)
+        result = await self.call_llm_structured(prompt)
 
         assert isinstance(result, dict)
         assert "analysis" in result
@@ -122,48 +146,84 @@ extracted_concept_info: extracted info relevant to the target concept (ONE strin
 
         return result
 
-    def post(self, shared, prep_res, exec_res):
+    async def post_async(self, shared, prep_res, exec_res):
         single_present_concept, chunk, current_extracted_concept_info = prep_res
 
-        shared["concept_dict"][single_present_concept] += (
-            "\n" + exec_res["extracted_concept_info"]
+        shared["concept_updates"][single_present_concept] = (
+            current_extracted_concept_info + "\n" + exec_res["extracted_concept_info"]
         )
 
 
 concept_update_type_switch_node = ConceptUpdateTypeSwitch()
-concept_add_node = ConceptAdd(max_retries=60, wait=5)
-concept_append_node = ConceptAppend(max_retries=60, wait=5)
+concept_add_node = ConceptAdd()
+concept_append_node = ConceptAppend()
 
 concept_update_type_switch_node - "add" >> concept_add_node
 concept_update_type_switch_node - "append" >> concept_append_node
 
-concept_update = Flow(start=concept_update_type_switch_node)
-batch_concept_update = BatchConceptUpdate(start=concept_update)
+concept_update = AsyncFlow(start=concept_update_type_switch_node)
+batch_concept_update = BatchConceptUpdate(
+    start=concept_update, max_concurrency=CONCEPT_UPDATE_CONCURRENCY
+)
 
 
 # *CONCEPT EXTRACTOR
-class ConceptExtractor(BatchFlow):
-    def prep(self, shared):
-        notes = self.params["notes"]
-        # splitter = TextSplitter.from_tiktoken_model("gpt-3.5-turbo", CHUNK_MAX_TOKENS)
-        splitter = MarkdownSplitter.from_tiktoken_model(
-            "gpt-3.5-turbo", CHUNK_MAX_TOKENS
-        )
-        chunks = [{"chunk": chunk} for chunk in splitter.chunks(notes)]
+@functools.lru_cache
+def get_splitter(chunk_max_tokens: int = CHUNK_MAX_TOKENS):
+    """Splitters load their tokenizer when built, so one is kept per chunk size for the process."""
+    # return TextSplitter.from_tiktoken_model("gpt-3.5-turbo", chunk_max_tokens)
+    return MarkdownSplitter.from_tiktoken_model("gpt-3.5-turbo", chunk_max_tokens)
+
+
+def split_notes(notes: str):
+    return get_splitter().chunks(notes)
+
+
+async def count_chunks(notes: str):
+    """Number of chunks (and so of extraction rounds) processing the notes takes."""
+    return len(await asyncio.to_thread(split_notes, notes))
+
+
+def chunk_fingerprint(chunk: str):
+    return hashlib.sha256(chunk.encode()).hexdigest()
+
+
+class ConceptExtractor(AsyncBatchFlow):
+    async def prep_async(self, shared):
+        chunks = [
+            {"chunk": chunk, "chunk_index": chunk_index}
+            for chunk_index, chunk in enumerate(self.params["chunks"])
+        ]
+        shared["chunk_concepts"] = [[] for _ in chunks]
 
         printd(chunks)
 
+        shared["chunks_done"] = 0
+        shared["chunks_total"] = len(chunks)
+        shared["on_progress"](shared["chunks_done"], shared["chunks_total"])
+
         return chunks
 
 
-class GetConceptListFromChunk(Node):
-    def prep(self, shared):
+class GetConceptListFromChunk(LLMNode):
+    output_fields = {
+        "analysis": (
+            structured_output.STRING,
+            "detailed step-by-step analysis of chunk (ONE string)",
+        ),
+        "present_concepts": (
+            structured_output.STRING_LIST,
+            "list of present concept names (LIST of strings)",
+        ),
+    }
+
+    async def prep_async(self, shared):
         concept_dict = shared["concept_dict"]
         concept_list = list(concept_dict.keys()) or "No extracted concepts yet"
         chunk = self.params["chunk"]
         return chunk, concept_list
 
-    def exec(self, inputs):
+    async def exec_async(self, inputs):
         chunk, concept_list = inputs
         prompt = f"""
 Given chunk of notes:
@@ -176,15 +236,9 @@ Each concept should be bite-sized, constituting ONE DISTINCT learning outcome wh
 Concept names should be succinct yet accurately describe the content of the concept by being framed as a concise learning outcome.
 If a concept overlaps with a previously extracted concept, use the EXACT SAME concept name to ensure that there are NO duplicate concepts.
 If you observe no concepts in the chunk, you may generate an empty list for present_concepts.
-Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
-```yaml
-analysis: detailed step-by-step analysis of chunk (ONE string)
-present_concepts: list of present concept names (LIST of strings)
-```
+{self.output_format()}
         """
-        resp = call_llm(prompt)
-        yaml_str = resp.split("```yaml")[1].split("```")[0].strip()
-        result = yaml.safe_load(yaml_str)
+        result = await self.call_llm_structured(prompt)
 
         assert isinstance(result, dict)
         assert "analysis" in result
@@ -195,24 +249,378 @@ present_concepts: list of present concept names (LIST of strings)
 
         return result
 
-    def post(self, shared, prep_res, exec_res):
+    async def post_async(self, shared, prep_res, exec_res):
         shared["present_concepts"] = exec_res["present_concepts"]
 
 
-get_concept_list_node = GetConceptListFromChunk(max_retries=60, wait=5)
+class MarkChunkDone(Node):
+    def post(self, shared, prep_res, exec_res):
+        shared["chunk_concepts"][self.params["chunk_index"]] = list(
+            dict.fromkeys(shared["present_concepts"])
+        )
+
+        shared["chunks_done"] += 1
+        shared["on_progress"](shared["chunks_done"], shared["chunks_total"])
+
 
-get_concept_list_node >> batch_concept_update
+get_concept_list_node = GetConceptListFromChunk()
+mark_chunk_done_node = MarkChunkDone()
 
-concept_extractor_chunk_flow = Flow(start=get_concept_list_node)
+get_concept_list_node >> batch_concept_update >> mark_chunk_done_node
+
+concept_extractor_chunk_flow = AsyncFlow(start=get_concept_list_node)
 concept_extractor_batch_flow = ConceptExtractor(start=concept_extractor_chunk_flow)
 
 
+# *PIPELINED CONCEPT EXTRACTOR
+# *Phase one lists the concepts of every chunk at once (without the names found in
+# *earlier chunks), duplicate names are then merged locally, and phase two extracts
+# *every concept at once, each walking through only the chunks that mention it.
+def normalise_concept_name(name: str):
+    return re.sub(r"\s+", " ", name).strip(" .,;:").casefold()
+
+
+class DiscoverConcepts(BoundedParallelBatchFlow):
+    async def prep_async(self, shared):
+        shared["chunks"] = self.params["chunks"]
+        # *Chunks whose concept names are already known (None if not) are not listed again
+        known_chunk_concepts = self.params.get("chunk_concepts") or [
+            None for _ in shared["chunks"]
+        ]
+        shared["chunk_concepts"] = [
+            [] if names is None else names for names in known_chunk_concepts
+        ]
+        shared["discovered_chunk_indices"] = [
+            chunk_index
+            for chunk_index, names in enumerate(known_chunk_concepts)
+            if names is None
+        ]
+
+        printd(shared["chunks"])
+
+        shared["chunks_done"] = 0
+        shared["chunks_total"] = len(shared["chunks"])
+        shared["on_progress"](shared["chunks_done"], shared["chunks_total"])
+
+        return [
+            {"chunk": shared["chunks"][chunk_index], "chunk_index": chunk_index}
+            for chunk_index in shared["discovered_chunk_indices"]
+        ]
+
+
+class DiscoverConceptListFromChunk(GetConceptListFromChunk):
+    async def post_async(self, shared, prep_res, exec_res):
+        shared["chunk_concepts"][self.params["chunk_index"]] = exec_res[
+            "present_concepts"
+        ]
+
+
+class ReconcileConceptNames(Node):
+    def prep(self, shared):
+        return shared["chunk_concepts"], list(shared["concept_dict"])
+
+    def exec(self, inputs):
+        chunk_concepts, known_concepts = inputs
+        # *normalised name -> first spelling seen, already extracted concepts first
+        canonical_names = {
+            normalise_concept_name(concept): concept for concept in known_concepts
+        }
+        concept_chunks = {}  # *canonical name -> indices of chunks mentioning it
+
+        for chunk_index, present_concepts in enumerate(chunk_concepts):
+            for concept in present_concepts:
+                name = canonical_names.setdefault(
+                    normalise_concept_name(concept), concept
+                )
+                chunk_indices = concept_chunks.setdefault(name, [])
+                if chunk_index not in chunk_indices:
+                    chunk_indices.append(chunk_index)
+
+        return concept_chunks
+
+    def post(self, shared, prep_res, exec_res):
+        printd(exec_res)
+
+        chunk_concepts, known_concepts = prep_res
+        shared["chunk_concepts"] = [[] for _ in chunk_concepts]
+        for concept, chunk_indices in exec_res.items():
+            for chunk_index in chunk_indices:
+                shared["chunk_concepts"][chunk_index].append(concept)
+        # *Concepts finish in any order, so this is the order they are put back in
+        shared["concept_order"] = list(dict.fromkeys([*known_concepts, *exec_res]))
+
+        if self.params.get("chunk_concepts") is None:
+            shared["concept_chunks"] = exec_res
+        else:  # *see reextract_chunk_concepts
+            rebuilt_concepts = {
+                concept
+                for chunk_index in shared["discovered_chunk_indices"]
+                for concept in shared["chunk_concepts"][chunk_index]
+            } | set(self.params["stale_concepts"])
+            shared["concept_chunks"] = {
+                concept: chunk_indices
+                for concept, chunk_indices in exec_res.items()
+                if concept in rebuilt_concepts
+            }
+            for concept in shared["concept_chunks"]:
+                shared["concept_dict"].pop(concept, None)  # *extracted from scratch
+
+        # *A chunk is done once every concept it mentions has been extracted from it
+        shared["chunk_pending_concepts"] = [0] * len(chunk_concepts)
+        for chunk_indices in shared["concept_chunks"].values():
+            for chunk_index in chunk_indices:
+                shared["chunk_pending_concepts"][chunk_index] += 1
+
+        shared["chunks_done"] = shared["chunk_pending_concepts"].count(0)
+        shared["on_progress"](shared["chunks_done"], shared["chunks_total"])
+
+        return self.params["mode"]
+
+
+def mark_concept_chunks_done(shared, chunk_indices):
+    for chunk_index in chunk_indices:
+        shared["chunk_pending_concepts"][chunk_index] -= 1
+        if shared["chunk_pending_concepts"][chunk_index] == 0:
+            shared["chunks_done"] += 1
+            shared["on_progress"](shared["chunks_done"], shared["chunks_total"])
+
+
+class ExtractConcepts(BoundedParallelBatchFlow):
+    async def prep_async(self, shared):
+        shared["concept_updates"] = {}
+
+        return [
+            {"single_present_concept": concept, "chunk_indices": chunk_indices}
+            for concept, chunk_indices in shared["concept_chunks"].items()
+        ]
+
+    async def post_async(self, shared, prep_res, exec_res):
+        shared["concept_dict"] = {
+            concept: shared["concept_dict"][concept]
+            for concept in shared["concept_order"]
+        }
+
+
+class ConceptChunkUpdates(AsyncBatchFlow):
+    async def prep_async(self, shared):
+        return [
+            {"chunk": shared["chunks"][chunk_index], "chunk_index": chunk_index}
+            for chunk_index in self.params["chunk_indices"]
+        ]
+
+
+class CommitConceptUpdate(Node):
+    def post(self, shared, prep_res, exec_res):
+        single_present_concept = self.params["single_present_concept"]
+        chunk_index = self.params["chunk_index"]
+
+        shared["concept_dict"][single_present_concept] = shared["concept_updates"][
+            single_present_concept
+        ]
+
+        mark_concept_chunks_done(shared, [chunk_index])
+
+
+# *CONSOLIDATED CONCEPT EXTRACTOR
+# *Same discovery as the pipelined extractor, but each concept is then extracted
+# *from all of its chunks in one call (or one call per token-budgeted group of
+# *chunks) instead of an add followed by an append per chunk.
+class ConsolidatedConceptGroups(AsyncBatchFlow):
+    async def prep_async(self, shared):
+        chunk_indices = self.params["chunk_indices"]
+        group_size = max(1, CONSOLIDATION_MAX_TOKENS // CHUNK_MAX_TOKENS)
+
+        return [
+            {"group_chunk_indices": chunk_indices[i : i + group_size]}
+            for i in range(0, len(chunk_indices), group_size)
+        ]
+
+
+class ConceptConsolidate(LLMNode):
+    output_fields = {
+        "analysis": (
+            structured_output.STRING,
+            "detailed step-by-step analysis of chunks (ONE string)",
+        ),
+        "extracted_concept_info": (
+            structured_output.STRING,
+            "extracted info relevant to the target concept (ONE string)",
+        ),
+    }
+
+    async def prep_async(self, shared):
+        single_present_concept = self.params["single_present_concept"]
+        group_chunk_indices = self.params["group_chunk_indices"]
+        chunks = [shared["chunks"][chunk_index] for chunk_index in group_chunk_indices]
+        current_extracted_concept_info = shared["concept_dict"].get(
+            single_present_concept
+        )
+
+        return (
+            single_present_concept,
+            group_chunk_indices,
+            chunks,
+            current_extracted_concept_info,
+        )
+
+    async def exec_async(self, inputs):
+        (
+            single_present_concept,
+            group_chunk_indices,
+            chunks,
+            current_extracted_concept_info,
+        ) = inputs
+        chunks_str = "\n".join(
+            f"Chunk {i + 1}:\n```\n{chunk}\n```" for i, chunk in enumerate(chunks)
+        )
+        current_extracted_concept_info_str = (
+            ""
+            if current_extracted_concept_info is None
+            else f"""Current extracted concept info:
+```
+{current_extracted_concept_info}
+```
+"""
+        )
+        prompt = f"""
+Given chunks of notes:
+{chunks_str}
+Target concept name: {single_present_concept}
+{current_extracted_concept_info_str}Analyse the chunks to pick out which parts of them are relevant to the target concept (e.g. make possible learning outcome from target concept name then pick out content which satisfies the learning outcome).
+You will then give distilled succinct statements, assertions, associations, concepts, analogies, and metaphors covering ALL of the chunks. 
+The idea is to capture as much, conceptually, as possible but with as few words as possible. 
+Write it in a way that makes sense to you, as the future audience will be another language model, not a human.
+Ensure that no information is repeated, whether it appears in several chunks or is already present in the current extracted concept info (if given).
+{self.output_format()}
+        """
+        result = await self.call_llm_structured(prompt)
+
+        assert isinstance(result, dict)
+        assert "analysis" in result
+        assert "extracted_concept_info" in result
+        assert isinstance(result["extracted_concept_info"], str)
+
+        return result
+
+    async def post_async(self, shared, prep_res, exec_res):
+        (
+            single_present_concept,
+            group_chunk_indices,
+            chunks,
+            current_extracted_concept_info,
+        ) = prep_res
+
+        shared["concept_dict"][single_present_concept] = (
+            exec_res["extracted_concept_info"]
+            if current_extracted_concept_info is None
+            else current_extracted_concept_info
+            + "\n"
+            + exec_res["extracted_concept_info"]
+        )
+
+        mark_concept_chunks_done(shared, group_chunk_indices)
+
+
+discover_concept_list_node = DiscoverConceptListFromChunk()
+discover_concepts = DiscoverConcepts(
+    start=discover_concept_list_node, max_concurrency=CHUNK_DISCOVERY_CONCURRENCY
+)
+reconcile_concept_names_node = ReconcileConceptNames()
+
+commit_concept_update_node = CommitConceptUpdate()
+pipelined_concept_update = AsyncFlow(start=concept_update_type_switch_node)
+pipelined_concept_update >> commit_concept_update_node
+concept_chunk_updates = ConceptChunkUpdates(start=pipelined_concept_update)
+extract_concepts_flow = ExtractConcepts(
+    start=concept_chunk_updates, max_concurrency=CONCEPT_UPDATE_CONCURRENCY
+)
+
+concept_consolidate_node = ConceptConsolidate()
+consolidated_concept_groups = ConsolidatedConceptGroups(start=concept_consolidate_node)
+consolidated_extract_concepts_flow = ExtractConcepts(
+    start=consolidated_concept_groups, max_concurrency=CONCEPT_UPDATE_CONCURRENCY
+)
+
+discover_concepts >> reconcile_concept_names_node
+reconcile_concept_names_node - "pipelined" >> extract_concepts_flow
+reconcile_concept_names_node - "consolidated" >> consolidated_extract_concepts_flow
+
+discovery_concept_extractor_flow = AsyncFlow(start=discover_concepts)
+
+
 # *Functions
-def extract_concepts(notes: str):
-    shared = {"concept_dict": {}}
-    concept_extractor_batch_flow.set_params({"notes": notes})
-    concept_extractor_batch_flow.run(shared)
-    return shared["concept_dict"]
+async def extract_concepts(notes: str, on_progress=None, mode=EXTRACTION_MODE):
+    concept_dict, chunk_concepts = await extract_chunk_concepts(
+        split_notes(notes), {}, on_progress, mode
+    )
+    return concept_dict
+
+
+async def extract_chunk_concepts(
+    chunks: list, concept_dict: dict, on_progress=None, mode=EXTRACTION_MODE
+):
+    """Extracts the concepts of some chunks on top of already extracted ones.
+
+    Returns the updated concept dict and the concept names found in each chunk.
+    """
+    shared = {
+        "concept_dict": dict(concept_dict),
+        "on_progress": on_progress or (lambda chunks_done, chunks_total: None),
+    }
+
+    match mode:
+        case "sequential":
+            flow = concept_extractor_batch_flow
+        case "pipelined" | "consolidated":
+            flow = discovery_concept_extractor_flow
+        case _:
+            raise ValueError("Invalid extraction mode")
+
+    flow = copy.copy(flow)  # *keeps params per-call
+    flow.set_params({"chunks": chunks, "mode": mode})
+    await flow.run_async(shared)
+    return shared["concept_dict"], shared["chunk_concepts"]
+
+
+async def reextract_chunk_concepts(
+    chunks: list,
+    chunk_concepts: list,
+    concept_dict: dict,
+    stale_concepts: list,
+    on_progress=None,
+    mode=EXTRACTION_MODE,
+):
+    """Brings a processed note's concepts up to date with its edited chunks.
+
+    chunk_concepts holds the concept names known for each chunk, or None for chunks
+    that are new or changed, which are the only ones whose concepts are listed again.
+    Every concept named by those chunks or in stale_concepts (e.g. named by chunks
+    that are gone) is then extracted again from scratch from all of the chunks that
+    mention it, so that nothing the old chunks said survives. Other concepts are
+    left as they are.
+
+    Returns the updated concept dict and the concept names found in each chunk.
+    """
+    shared = {
+        "concept_dict": dict(concept_dict),
+        "on_progress": on_progress or (lambda chunks_done, chunks_total: None),
+    }
+
+    # *Sequential extraction cannot revisit earlier chunks, so it rebuilds consolidated
+    if mode == "sequential":
+        mode = "consolidated"
+
+    flow = copy.copy(discovery_concept_extractor_flow)  # *keeps params per-call
+    flow.set_params(
+        {
+            "chunks": chunks,
+            "chunk_concepts": chunk_concepts,
+            "stale_concepts": stale_concepts,
+            "mode": mode,
+        }
+    )
+    await flow.run_async(shared)
+    return shared["concept_dict"], shared["chunk_concepts"]
 
 
 if __name__ == "__main__":
@@ -221,7 +629,9 @@ if __name__ == "__main__":
     assert input("DO YOU WISH TO PROCEED? (y/n) ").strip() == "y", "abort"
 
     print(
-        extract_concepts(
-            "The characteristics of the Dead Sea: Salt lake located on the border between Israel and Jordan. Its shoreline is the lowest point on the Earth's surface, averaging 396 m below sea level. It is 74 km long. It is seven times as salty (30% by volume) as the ocean. Its density keeps swimmers afloat. Only simple organisms can live in its saline waters."
+        asyncio.run(
+            extract_concepts(
+                "The characteristics of the Dead Sea: Salt lake located on the border between Israel and Jordan. Its shoreline is the lowest point on the Earth's surface, averaging 396 m below sea level. It is 74 km long. It is seven times as salty (30% by volume) as the ocean. Its density keeps swimmers afloat. Only simple organisms can live in its saline waters."
+            )
         )
     )
@@ -1,4 +1,5 @@
-from datetime import timedelta
+import json
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
 
 from fsrs import Card, Rating, ReviewLog, Scheduler
@@ -14,13 +15,15 @@ CREATE TABLE IF NOT EXISTS concepts (
 CREATE TABLE IF NOT EXISTS cards (
     id INTEGER PRIMARY KEY NOT NULL,
     concept_id TEXT NOT NULL,
+    note_id TEXT, -- copied from the card's concept, for cards_note_queue_idx
     state TEXT,
     step TEXT,
     stability REAL,
     difficulty REAL,
     due TEXT,
     last_review TEXT,
-    FOREIGN KEY(concept_id) REFERENCES concepts(id) ON DELETE CASCADE
+    FOREIGN KEY(concept_id) REFERENCES concepts(id) ON DELETE CASCADE,
+    FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE
 );
 CREATE TABLE IF NOT EXISTS review_logs (
     id         INTEGER PRIMARY KEY,
@@ -30,6 +33,14 @@ CREATE TABLE IF NOT EXISTS review_logs (
     review_duration TEXT,
     FOREIGN KEY(card_id) REFERENCES cards(id) ON DELETE CASCADE
 );
+CREATE TABLE IF NOT EXISTS note_chunks (
+    note_id     TEXT NOT NULL,
+    position    INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL, -- sha256 of the chunk's text
+    concepts    TEXT NOT NULL, -- JSON list of the concept names extracted from it
+    PRIMARY KEY(note_id, position),
+    FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE
+) WITHOUT ROWID;
 """
 
 scheduler = Scheduler(
@@ -51,33 +62,243 @@ scheduler = Scheduler(
 )
 
 
-def create_concept_card(connection, note_id: str, name: str, content: str):
-    concept_id = str(uuid4())
-    db.execute_write_query(
+def create_concept_cards(connection, note_id: str, concept_dict: dict):
+    """Inserts all of a note's concepts with their cards and marks the note processed, atomically."""
+    concept_rows = []
+    card_rows = []
+    for name, content in concept_dict.items():
+        concept_id = str(uuid4())
+        concept_rows.append((concept_id, note_id, name, content))
+
+        card_dict = Card().to_dict()
+        card_rows.append(
+            (
+                card_dict["card_id"],
+                concept_id,
+                note_id,
+                card_dict["state"],
+                card_dict["step"],
+                card_dict["stability"],
+                card_dict["difficulty"],
+                db.utc_timestamp(card_dict["due"]),
+                db.utc_timestamp(card_dict["last_review"]),
+            )
+        )
+
+    with db.transaction(connection):
+        db.execute_many_query(
+            connection,
+            """
+            INSERT INTO concepts (id, note_id, name, content)
+            VALUES (?, ?, ?, ?)
+            """,
+            concept_rows,
+            commit=False,
+        )
+        db.execute_many_query(
+            connection,
+            """
+            INSERT INTO cards (id, concept_id, note_id, state, step, stability, difficulty, due, last_review)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            card_rows,
+            commit=False,
+        )
+        db.execute_write_query(
+            connection,
+            """
+            UPDATE notes
+            SET status = 'processed'
+            WHERE id = ?
+            """,
+            (note_id,),
+            commit=False,
+        )
+
+
+def get_note_extraction_state(connection, note_id: str):
+    """The concept names extracted from each chunk fingerprint of a note, and its concepts' content."""
+    chunk_rows = db.execute_read_query(
         connection,
-        """
-        INSERT INTO concepts (id, note_id, name, content)
-        VALUES (?, ?, ?, ?)
+        "SELECT fingerprint, concepts FROM note_chunks WHERE note_id = ?",
+        (note_id,),
+    )
+    concept_rows = db.execute_read_query(
+        connection,
+        "SELECT name, content FROM concepts WHERE note_id = ? ORDER BY rowid",
+        (note_id,),
+    )
+
+    return (
+        {fingerprint: json.loads(names) for fingerprint, names in chunk_rows},
+        dict(concept_rows),
+    )
+
+
+def merge_concept_cards(
+    connection, note_id: str, concept_dict: dict, chunk_fingerprints: list
+):
+    """Updates the content of a note's existing concepts, keeping their cards and review
+    history, adds cards for new ones and replaces its chunk fingerprints, atomically.
+
+    chunk_fingerprints is a list of (fingerprint, concept names) pairs in chunk order.
+    Returns the number of concepts added.
+    """
+    with db.transaction(connection):
+        existing_ids = dict(
+            db.execute_read_query(
+                connection,
+                "SELECT name, id FROM concepts WHERE note_id = ?",
+                (note_id,),
+            )
+        )
+        new_concepts = {
+            name: content
+            for name, content in concept_dict.items()
+            if name not in existing_ids
+        }
+
+        db.execute_many_query(
+            connection,
+            "UPDATE concepts SET content = ? WHERE id = ? AND content != ?",
+            [
+                (content, existing_ids[name], content)
+                for name, content in concept_dict.items()
+                if name in existing_ids
+            ],
+            commit=False,
+        )
+        create_concept_cards(connection, note_id, new_concepts)
+        db.execute_write_query(
+            connection,
+            "DELETE FROM note_chunks WHERE note_id = ?",
+            (note_id,),
+            commit=False,
+        )
+        db.execute_many_query(
+            connection,
+            """
+            INSERT INTO note_chunks (note_id, position, fingerprint, concepts)
+            VALUES (?, ?, ?, ?)
+            """,
+            [
+                (note_id, position, fingerprint, json.dumps(names))
+                for position, (fingerprint, names) in enumerate(chunk_fingerprints)
+            ],
+            commit=False,
+        )
+
+    return len(new_concepts)
+
+
+def srs_info_from_card_row(
+    card_id, state, step, stability, difficulty, due, last_review
+):
+    return {
+        "id": card_id,
+        "state": state,
+        "step": step,
+        "stability": stability,
+        "difficulty": difficulty,
+        "due": due,
+        "last_review": last_review,
+    }
+
+
+def get_concepts_with_cards(connection, note_ids=None, include_content=True):
+    """Concepts joined with their cards in one query, optionally limited to some notes."""
+    values = ()
+    where = ""
+    if note_ids is not None:
+        values = tuple(note_ids)
+        where = f"WHERE concepts.note_id IN ({', '.join('?' * len(values))})"
+
+    rows = db.execute_read_query(
+        connection,
+        f"""
+        SELECT concepts.id, concepts.note_id, concepts.name,
+            {"concepts.content" if include_content else "NULL"},
+            cards.id, cards.state, cards.step, cards.stability, cards.difficulty,
+            cards.due, cards.last_review
+        FROM concepts
+        JOIN cards ON cards.concept_id = concepts.id
+        {where}
+        ORDER BY concepts.rowid
         """,
-        (concept_id, note_id, name, content),
+        values,
     )
 
-    card_dict = Card().to_dict()
+    return [
+        {
+            "id": id,
+            "note_id": note_id,
+            "name": name,
+            "content": content,
+            "srs_info": srs_info_from_card_row(*card_row),
+        }
+        for id, note_id, name, content, *card_row in rows
+    ]
 
-    db.execute_write_query(
+
+def get_concept_with_card(connection, concept_id: str):
+    rows = db.execute_read_query(
         connection,
         """
-        INSERT INTO cards (id, concept_id, state, step, stability, difficulty, due, last_review)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        SELECT concepts.note_id, concepts.name, concepts.content,
+            cards.id, cards.state, cards.step, cards.stability, cards.difficulty,
+            cards.due, cards.last_review
+        FROM concepts
+        JOIN cards ON cards.concept_id = concepts.id
+        WHERE concepts.id = ?
         """,
-        (
-            card_dict["card_id"],
-            concept_id,
-            card_dict["state"],
-            card_dict["step"],
-            card_dict["stability"],
-            card_dict["difficulty"],
-            card_dict["due"],
-            card_dict["last_review"],
-        ),
+        (concept_id,),
     )
+
+    if not rows:
+        return None
+    note_id, name, content, *card_row = rows[0]
+
+    return {
+        "id": concept_id,
+        "note_id": note_id,
+        "name": name,
+        "content": content,
+        "srs_info": srs_info_from_card_row(*card_row),
+    }
+
+
+def get_due_concepts(connection, limit: int, include_content=True):
+    """Reviewed cards that are due across all notes, least likely to be recalled first."""
+    rows = db.execute_read_query(
+        connection,
+        f"""
+        SELECT concepts.id, concepts.note_id, concepts.name,
+            {"concepts.content" if include_content else "NULL"},
+            retrievability(cards.stability, cards.last_review, :now, :decay)
+                AS retrievability,
+            cards.id, cards.state, cards.step, cards.stability, cards.difficulty,
+            cards.due, cards.last_review
+        FROM cards
+        JOIN concepts ON concepts.id = cards.concept_id
+        WHERE cards.due <= :now AND cards.last_review IS NOT NULL
+        ORDER BY retrievability
+        LIMIT :limit
+        """,
+        {
+            "now": db.utc_timestamp(datetime.now(timezone.utc)),
+            "decay": scheduler.parameters[20],
+            "limit": limit,
+        },
+    )
+
+    return [
+        {
+            "id": id,
+            "note_id": note_id,
+            "name": name,
+            "content": content,
+            "retrievability": retrievability,
+            "srs_info": srs_info_from_card_row(*card_row),
+        }
+        for id, note_id, name, content, retrievability, *card_row in rows
+    ]
@@ -0,0 +1,64 @@
+import asyncio
+
+from pocketflow import AsyncParallelBatchFlow
+
+
+async def gather_limited(aws, limit: int):
+    """Like asyncio.gather, but runs at most `limit` awaitables at a time.
+
+    Results are returned in the order the awaitables were given. If one raises,
+    the others are cancelled, and have stopped by the time the exception propagates.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    aws = list(aws)
+    tasks = [asyncio.create_task(run(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for aw in aws:
+            if asyncio.iscoroutine(aw):
+                aw.close()  # *those cancelled before they started, or Python warns
+
+
+async def as_completed_limited(aws, limit: int):
+    """Like gather_limited, but yields (index, result) pairs as soon as each finishes.
+
+    Awaitables still pending when the caller stops iterating are cancelled.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(index, aw):
+        async with semaphore:
+            return index, await aw
+
+    tasks = [asyncio.create_task(run(index, aw)) for index, aw in enumerate(aws)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class BoundedParallelBatchFlow(AsyncParallelBatchFlow):
+    """AsyncParallelBatchFlow that runs at most `max_concurrency` batch items at once."""
+
+    def __init__(self, start=None, max_concurrency: int = 1):
+        super().__init__(start=start)
+        self.max_concurrency = max_concurrency
+
+    async def _run_async(self, shared):
+        pr = await self.prep_async(shared) or []
+        await gather_limited(
+            (self._orch_async(shared, {**self.params, **bp}) for bp in pr),
+            self.max_concurrency,
+        )
+        return await self.post_async(shared, pr, None)
@@ -1,3 +1,5 @@
+import os
+
 from dotenv import dotenv_values
 
 CONFIG = dotenv_values(".env")
@@ -10,6 +12,40 @@ VLM_API_BASE_URL = CONFIG["VLM_API_BASE_URL"]
 VLM_API_KEY = CONFIG["VLM_API_KEY"]
 VLM_NAME = CONFIG["VLM_NAME"]
 
+LLM_MAX_CONCURRENCY = int(CONFIG.get("LLM_MAX_CONCURRENCY", 8))
+VLM_MAX_CONCURRENCY = int(CONFIG.get("VLM_MAX_CONCURRENCY", 4))
+
+VLM_MIN_IMAGE_BYTES = int(CONFIG.get("VLM_MIN_IMAGE_BYTES", 2048))
+VLM_MIN_IMAGE_PIXELS = int(CONFIG.get("VLM_MIN_IMAGE_PIXELS", 4096))
+
+LLM_CACHE_TTL_SECONDS = int(CONFIG.get("LLM_CACHE_TTL_SECONDS", 2592000))
+LLM_CACHE_MAX_ENTRIES = int(CONFIG.get("LLM_CACHE_MAX_ENTRIES", 10000))
+
+LLM_REQUESTS_PER_SECOND = float(CONFIG.get("LLM_REQUESTS_PER_SECOND", 0))
+VLM_REQUESTS_PER_SECOND = float(CONFIG.get("VLM_REQUESTS_PER_SECOND", 0))
+LLM_RETRY_ATTEMPTS = int(CONFIG.get("LLM_RETRY_ATTEMPTS", 8))
+LLM_RETRY_BASE_DELAY = float(CONFIG.get("LLM_RETRY_BASE_DELAY", 1))
+LLM_RETRY_MAX_DELAY = float(CONFIG.get("LLM_RETRY_MAX_DELAY", 60))
+LLM_PARSE_ATTEMPTS = int(CONFIG.get("LLM_PARSE_ATTEMPTS", 10))
+LLM_OUTPUT_FORMAT = CONFIG.get("LLM_OUTPUT_FORMAT", "yaml").strip().lower()
+
 CHUNK_MAX_TOKENS = int(CONFIG["CHUNK_MAX_TOKENS"])
+CONCEPT_UPDATE_CONCURRENCY = int(CONFIG.get("CONCEPT_UPDATE_CONCURRENCY", 5))
+CHUNK_DISCOVERY_CONCURRENCY = int(CONFIG.get("CHUNK_DISCOVERY_CONCURRENCY", 8))
+EXTRACTION_MODE = CONFIG.get("EXTRACTION_MODE", "sequential").strip().lower()
+CONSOLIDATION_MAX_TOKENS = int(CONFIG.get("CONSOLIDATION_MAX_TOKENS", 8000))
+
+QUIZ_GENERATION_CONCURRENCY = int(CONFIG.get("QUIZ_GENERATION_CONCURRENCY", 8))
+QUIZ_GRADING_CONCURRENCY = int(CONFIG.get("QUIZ_GRADING_CONCURRENCY", 8))
+
+PROCESSING_WORKERS = int(CONFIG.get("PROCESSING_WORKERS", 2))
+UPLOAD_DIR = CONFIG.get("UPLOAD_DIR", "uploads")
+PDF_PROCESSES = int(CONFIG.get("PDF_PROCESSES", os.cpu_count() or 1))
+PDF_PAGES_PER_TASK = int(CONFIG.get("PDF_PAGES_PER_TASK", 50))
+
+SQLITE_BUSY_TIMEOUT_MS = int(CONFIG.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHE_SIZE_KIB = int(CONFIG.get("SQLITE_CACHE_SIZE_KIB", 65536))
+SQLITE_MMAP_SIZE = int(CONFIG.get("SQLITE_MMAP_SIZE", 268435456))
+SQLITE_THREADS = int(CONFIG.get("SQLITE_THREADS", 4))
 
 DEBUG_MODE = True if CONFIG["DEBUG_MODE"].strip().lower() == "true" else False
@@ -1,34 +1,172 @@
+import asyncio
 import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from sqlite3 import Error
 
+from config import (
+    DEBUG_MODE,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE_KIB,
+    SQLITE_MMAP_SIZE,
+    SQLITE_THREADS,
+)
 from debug import printd
 
 
+def retrievability(stability, last_review, now, decay):
+    """FSRS forgetting curve: probability of recalling a card `now`, given its decay parameter.
+
+    Same curve as fsrs.Scheduler.get_card_retrievability, without building a Card
+    (which sleeps to generate an id) for every row it is called on.
+    """
+    if stability is None or last_review is None:
+        return 0
+
+    factor = 0.9 ** (-1 / decay) - 1
+    elapsed_days = max(
+        0, (datetime.fromisoformat(now) - datetime.fromisoformat(last_review)).days
+    )
+
+    return (1 + factor * elapsed_days / stability) ** -decay
+
+
 def create_connection(path):
-    connection = sqlite3.connect(path)
+    # *check_same_thread=False only so ConnectionPool.close can close every thread's
+    # *connection; each connection is otherwise only used by the thread that made it
+    connection = sqlite3.connect(
+        path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False
+    )
+
+    connection.execute(
+        "PRAGMA journal_mode = WAL"
+    )  # *readers no longer block on writers
+    connection.execute("PRAGMA synchronous = NORMAL")  # *durable enough under WAL
+    connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KIB}")
+    connection.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    connection.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    connection.execute("PRAGMA temp_store = MEMORY")
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.create_function("retrievability", 4, retrievability, deterministic=True)
     printd("Connection to SQLite DB successful")
 
     return connection
 
 
-def execute_write_query(connection, query, values=None):  # values can be tuple
+class ConnectionPool:
+    """Hands out one connection per thread, so the pool is safe to share with worker threads.
+
+    Async code should go through run, which executes queries on the pool's own
+    threads instead of blocking the event loop.
+    """
+
+    def __init__(self, path, max_threads: int = SQLITE_THREADS):
+        self.path = path
+        self.local = threading.local()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_threads, thread_name_prefix="sqlite"
+        )
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = create_connection(self.path)
+            self.local.connection = connection
+            with self.lock:
+                self.connections.append(connection)
+
+        return connection
+
+    def call(self, fn, *args):
+        return fn(self.connection(), *args)
+
+    async def run(self, fn, *args):
+        """Awaits fn(connection, *args) run on one of the pool's threads."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.call, fn, *args
+        )
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            for connection in self.connections:
+                # *Folds the WAL back into the main file so it is not left beside it
+                connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                connection.close()
+            self.connections = []
+        self.local = threading.local()
+        printd("SQLite connection pool closed")
+
+
+def utc_timestamp(value):
+    """Fixed-width UTC ISO 8601 text, so stored timestamps compare correctly in SQL."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def execute_write_query(
+    connection, query, values=None, commit=True
+):  # values can be tuple
     cursor = connection.cursor()
     if values:
         cursor.execute(query, values)
     else:
         cursor.execute(query)
-    connection.commit()
-    printd(f"Query {query} executed successfully")
+    if commit:
+        connection.commit()
+    if DEBUG_MODE:  # *skips formatting the query on hot paths
+        printd(f"Query {query} executed successfully")
 
     return cursor.lastrowid
 
 
+def execute_many_query(
+    connection, query, values_list, commit=True
+):  # values_list is a list of tuples
+    cursor = connection.cursor()
+    cursor.executemany(query, values_list)
+    if commit:
+        connection.commit()
+    if DEBUG_MODE:
+        printd(f"Query {query} executed {len(values_list)} times successfully")
+
+    return cursor.rowcount
+
+
+@contextmanager
+def transaction(connection):  # use commit=False for the queries inside
+    if connection.in_transaction:  # *nested: the outermost transaction commits
+        yield connection
+        return
+
+    # *IMMEDIATE takes the write lock up front (waiting up to busy_timeout for it), since
+    # *a transaction that reads first cannot wait for the lock once another write lands
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.rollback()
+        raise
+    connection.commit()
+
+
 def execute_read_query(connection, query, values=None):  # values can be tuple
     cursor = connection.cursor()
     if values:
         cursor.execute(query, values)
     else:
         cursor.execute(query)
-    printd(f"Query {query} executed successfully")
+    if DEBUG_MODE:  # *skips formatting the query on hot paths
+        printd(f"Query {query} executed successfully")
 
     return cursor.fetchall()
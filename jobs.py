@@ -0,0 +1,402 @@
+import asyncio
+import os
+from datetime import datetime, timezone
+from uuid import uuid4
+
+import concept_extraction
+import concepts
+import db
+import notes
+from debug import printd
+
+"""
+CREATE TABLE IF NOT EXISTS jobs (
+    id                 TEXT PRIMARY KEY NOT NULL,
+    note_id            TEXT NOT NULL,
+    status             TEXT NOT NULL, -- queued|running|completed|failed
+    chunks_done        INTEGER NOT NULL DEFAULT 0,
+    chunks_total       INTEGER DEFAULT NULL,
+    concepts_generated INTEGER DEFAULT NULL,
+    error              TEXT DEFAULT NULL,
+    created_at         TEXT NOT NULL,
+    kind               TEXT NOT NULL DEFAULT 'process', -- process|ingest
+    source_type        TEXT DEFAULT NULL, -- content_type of the upload, for ingest jobs
+    FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE
+);
+
+For ingest jobs, chunks_done/chunks_total count the document's images instead.
+"""
+
+
+class JobQueue:
+    """Bounded pool of workers that ingest uploaded files and turn notes into concepts.
+
+    Every job is mirrored in the jobs table so its progress can be polled and
+    so jobs interrupted by a crash can be picked up again on startup.
+    """
+
+    def __init__(self, pool, max_workers: int, upload_dir: str):
+        self.pool = pool
+        self.max_workers = max_workers
+        self.upload_dir = upload_dir
+        self.queue = asyncio.Queue()
+        self.workers = []
+
+    async def start(self):
+        await self.recover()
+        self.workers = [
+            asyncio.create_task(self.work()) for _ in range(self.max_workers)
+        ]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    async def enqueue(self, note_id: str, from_status: str = "pending"):
+        """Queues a note for processing if it has from_status, returning the job's id (else None)."""
+        job_id = str(uuid4())
+        if not await self.pool.run(self.insert_job, job_id, note_id, from_status):
+            return None
+
+        self.queue.put_nowait((job_id, note_id, "process"))
+        return job_id
+
+    def upload_path(self, note_id: str):
+        return os.path.join(self.upload_dir, note_id)
+
+    async def enqueue_upload(self, note_id: str, name: str, source_type: str):
+        """Creates an 'ingesting' note for a file already saved at upload_path(note_id)."""
+        job_id = str(uuid4())
+        await self.pool.run(self.insert_upload, job_id, note_id, name, source_type)
+
+        self.queue.put_nowait((job_id, note_id, "ingest"))
+        return job_id
+
+    @staticmethod
+    def insert_upload(connection, job_id: str, note_id: str, name: str, source_type):
+        with db.transaction(connection):
+            db.execute_write_query(
+                connection,
+                """
+                INSERT INTO notes (id, name, content, status)
+                VALUES (?, ?, '', 'ingesting')
+                """,
+                (note_id, name),
+                commit=False,
+            )
+            db.execute_write_query(
+                connection,
+                """
+                INSERT INTO jobs (id, note_id, status, created_at, kind, source_type)
+                VALUES (?, ?, 'queued', ?, 'ingest', ?)
+                """,
+                (job_id, note_id, datetime.now(timezone.utc).isoformat(), source_type),
+                commit=False,
+            )
+
+    @staticmethod
+    def insert_job(connection, job_id: str, note_id: str, from_status: str):
+        with db.transaction(connection):
+            # *Checks the status in the same statement, so a note is only ever queued once
+            cursor = connection.execute(
+                """
+                UPDATE notes
+                SET status = 'processing'
+                WHERE id = ? AND status = ?
+                """,
+                (note_id, from_status),
+            )
+            if cursor.rowcount == 0:
+                return False
+
+            db.execute_write_query(
+                connection,
+                """
+                INSERT INTO jobs (id, note_id, status, created_at)
+                VALUES (?, ?, 'queued', ?)
+                """,
+                (job_id, note_id, datetime.now(timezone.utc).isoformat()),
+                commit=False,
+            )
+
+        return True
+
+    async def recover(self):
+        interrupted_notes = await self.pool.run(
+            db.execute_read_query,
+            "SELECT id, status FROM notes WHERE status IN ('processing', 'ingesting')",
+        )
+
+        for note_id, note_status in interrupted_notes:
+            active_job = await self.pool.run(
+                db.execute_read_query,
+                """
+                SELECT id, kind
+                FROM jobs
+                WHERE note_id = ? AND status IN ('queued', 'running')
+                ORDER BY created_at DESC
+                LIMIT 1
+                """,
+                (note_id,),
+            )
+
+            if not active_job and note_status == "ingesting":
+                printd(f"Upload of note {note_id} has no job record to resume")
+                await self.pool.run(
+                    db.execute_write_query,
+                    "UPDATE notes SET status = 'failed' WHERE id = ?",
+                    (note_id,),
+                )
+                continue
+
+            if not active_job:
+                printd(f"Re-enqueueing note {note_id} without a job record")
+                await self.enqueue(note_id, from_status="processing")
+                continue
+
+            job_id, kind = active_job[0]
+            printd(f"Re-enqueueing interrupted job {job_id} for note {note_id}")
+            await self.pool.run(
+                db.execute_write_query,
+                """
+                UPDATE jobs
+                SET status = 'queued', chunks_done = 0, chunks_total = NULL
+                WHERE id = ?
+                """,
+                (job_id,),
+            )
+            self.queue.put_nowait((job_id, note_id, kind))
+
+    async def work(self):
+        while True:
+            job_id, note_id, kind = await self.queue.get()
+            try:
+                if kind == "ingest":
+                    await self.run_ingest_job(job_id, note_id)
+                else:
+                    await self.run_job(job_id, note_id)
+            finally:
+                self.queue.task_done()
+
+    async def run_ingest_job(self, job_id: str, note_id: str):
+        result = await self.pool.run(
+            db.execute_read_query,
+            """
+            SELECT notes.name, jobs.source_type
+            FROM jobs
+            JOIN notes ON notes.id = jobs.note_id
+            WHERE jobs.id = ?
+            """,
+            (job_id,),
+        )
+
+        path = self.upload_path(note_id)
+        if not result:
+            printd(f"Note {note_id} was deleted before job {job_id} started")
+            await asyncio.to_thread(remove_file, path)
+            return
+        name, source_type = result[0]
+
+        await self.pool.run(
+            db.execute_write_query,
+            "UPDATE jobs SET status = 'running' WHERE id = ?",
+            (job_id,),
+        )
+
+        def on_progress(images_done, images_total):
+            self.pool.executor.submit(
+                self.pool.call, self.set_progress, job_id, images_done, images_total
+            )
+
+        try:
+            content = await notes.process_file(path, name, source_type, on_progress)
+            chunk_count = await concept_extraction.count_chunks(content)
+            await self.pool.run(
+                self.complete_ingest_job, job_id, note_id, content, chunk_count
+            )
+        except Exception as e:
+            printd(f"Ingest job {job_id} for note {note_id} failed: {e!r}")
+            await self.pool.run(self.fail_ingest_job, job_id, note_id, repr(e))
+
+        await asyncio.to_thread(remove_file, path)
+
+    @staticmethod
+    def complete_ingest_job(
+        connection, job_id: str, note_id: str, content: str, chunk_count: int
+    ):
+        with db.transaction(connection):
+            db.execute_write_query(
+                connection,
+                """
+                UPDATE notes
+                SET content = ?, chunk_count = ?, status = 'pending'
+                WHERE id = ?
+                """,
+                (content, chunk_count, note_id),
+                commit=False,
+            )
+            db.execute_write_query(
+                connection,
+                "UPDATE jobs SET status = 'completed' WHERE id = ?",
+                (job_id,),
+                commit=False,
+            )
+
+    @staticmethod
+    def fail_ingest_job(connection, job_id: str, note_id: str, error: str):
+        # *Nothing to retry from once the upload is gone, so the note is marked failed
+        with db.transaction(connection):
+            db.execute_write_query(
+                connection,
+                "UPDATE notes SET status = 'failed' WHERE id = ?",
+                (note_id,),
+                commit=False,
+            )
+            db.execute_write_query(
+                connection,
+                "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?",
+                (error, job_id),
+                commit=False,
+            )
+
+    async def run_job(self, job_id: str, note_id: str):
+        result = await self.pool.run(
+            db.execute_read_query,
+            "SELECT content FROM notes WHERE id = ?",
+            (note_id,),
+        )
+
+        if not result:
+            printd(f"Note {note_id} was deleted before job {job_id} started")
+            return
+        content = result[0][0]
+
+        await self.pool.run(
+            db.execute_write_query,
+            "UPDATE jobs SET status = 'running' WHERE id = ?",
+            (job_id,),
+        )
+
+        def on_progress(chunks_done, chunks_total):
+            # *Called from sync flow nodes, so the write is handed off without waiting
+            self.pool.executor.submit(
+                self.pool.call, self.set_progress, job_id, chunks_done, chunks_total
+            )
+
+        try:
+            # *Only chunks that are new since the note was last processed are read
+            # *for concept names, and only the concepts they affect are extracted again
+            chunks = await asyncio.to_thread(concept_extraction.split_notes, content)
+            fingerprints = [
+                concept_extraction.chunk_fingerprint(chunk) for chunk in chunks
+            ]
+            known_chunks, known_concepts = await self.pool.run(
+                concepts.get_note_extraction_state, note_id
+            )
+
+            if known_concepts:
+                current_fingerprints = set(fingerprints)
+                stale_concepts = [
+                    concept
+                    for fingerprint, names in known_chunks.items()
+                    if fingerprint not in current_fingerprints
+                    for concept in names
+                ]
+                extracted_concepts, chunk_concepts = (
+                    await concept_extraction.reextract_chunk_concepts(
+                        chunks,
+                        [known_chunks.get(fingerprint) for fingerprint in fingerprints],
+                        known_concepts,
+                        stale_concepts,
+                        on_progress,
+                    )
+                )
+            else:
+                extracted_concepts, chunk_concepts = (
+                    await concept_extraction.extract_chunk_concepts(
+                        chunks, {}, on_progress
+                    )
+                )
+
+            await self.pool.run(
+                self.complete_job,
+                job_id,
+                note_id,
+                extracted_concepts,
+                list(zip(fingerprints, chunk_concepts)),
+            )
+        except Exception as e:
+            printd(f"Job {job_id} for note {note_id} failed: {e!r}")
+            await self.pool.run(self.fail_job, job_id, note_id, repr(e))
+
+    @staticmethod
+    def complete_job(
+        connection,
+        job_id: str,
+        note_id: str,
+        extracted_concepts: dict,
+        chunk_fingerprints: list,
+    ):
+        # *Concepts, cards, chunks, note status and job status land together or not at all
+        with db.transaction(connection):
+            concepts_generated = concepts.merge_concept_cards(
+                connection, note_id, extracted_concepts, chunk_fingerprints
+            )
+            # *Notes written before chunks were counted get their count here
+            db.execute_write_query(
+                connection,
+                "UPDATE notes SET chunk_count = ? WHERE id = ?",
+                (len(chunk_fingerprints), note_id),
+                commit=False,
+            )
+            db.execute_write_query(
+                connection,
+                """
+                UPDATE jobs
+                SET status = 'completed', concepts_generated = ?
+                WHERE id = ?
+                """,
+                (concepts_generated, job_id),
+                commit=False,
+            )
+
+    @staticmethod
+    def fail_job(connection, job_id: str, note_id: str, error: str):
+        with db.transaction(connection):
+            db.execute_write_query(
+                connection,
+                """
+                UPDATE notes
+                SET status = 'pending'
+                WHERE id = ?
+                """,
+                (note_id,),
+                commit=False,
+            )
+            db.execute_write_query(
+                connection,
+                "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?",
+                (error, job_id),
+                commit=False,
+            )
+
+    @staticmethod
+    def set_progress(connection, job_id: str, chunks_done: int, chunks_total: int):
+        # *Progress writes can finish out of order on the pool's threads, so never go back
+        db.execute_write_query(
+            connection,
+            """
+            UPDATE jobs
+            SET chunks_done = ?, chunks_total = ?
+            WHERE id = ? AND chunks_done <= ?
+            """,
+            (chunks_done, chunks_total, job_id, chunks_done),
+        )
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
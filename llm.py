@@ -1,58 +1,251 @@
-from openai import OpenAI
+import asyncio
+import hashlib
 
+from httpx import Limits
+from openai import APIError, AsyncOpenAI, DefaultAsyncHttpxClient
+from pocketflow import AsyncNode
+
+import retry
+import structured_output
 from config import (
     LLM_API_BASE_URL,
     LLM_API_KEY,
+    LLM_MAX_CONCURRENCY,
     LLM_NAME,
+    LLM_OUTPUT_FORMAT,
+    LLM_PARSE_ATTEMPTS,
+    LLM_REQUESTS_PER_SECOND,
+    LLM_RETRY_ATTEMPTS,
+    LLM_RETRY_BASE_DELAY,
+    LLM_RETRY_MAX_DELAY,
     VLM_API_BASE_URL,
     VLM_API_KEY,
+    VLM_MAX_CONCURRENCY,
     VLM_NAME,
+    VLM_REQUESTS_PER_SECOND,
 )
 from debug import printd
+from llm_cache import cache_key
+
+SYSTEM_PROMPT = "Always assist with care, respect, and truth. Respond with utmost utility yet securely. Avoid harmful, unethical, prejudiced, or negative content. Ensure replies promote fairness and positivity."  # *https://www.promptingguide.ai/models/mixtral#system-prompt-to-enforce-guardrails
+
+# *One keep-alive connection pool shared by both clients (httpx pools per host)
+http_client = DefaultAsyncHttpxClient(
+    limits=Limits(
+        max_connections=LLM_MAX_CONCURRENCY + VLM_MAX_CONCURRENCY,
+        max_keepalive_connections=LLM_MAX_CONCURRENCY + VLM_MAX_CONCURRENCY,
+    )
+)
+
+# *max_retries=0 since requests are retried by retry.call_with_retries instead
+llm_client = AsyncOpenAI(
+    base_url=LLM_API_BASE_URL,
+    api_key=LLM_API_KEY,
+    http_client=http_client,
+    max_retries=0,
+)
+vlm_client = AsyncOpenAI(
+    base_url=VLM_API_BASE_URL,
+    api_key=VLM_API_KEY,
+    http_client=http_client,
+    max_retries=0,
+)
+
+# *Caps in-flight requests per endpoint so bursts of nodes queue here instead of at the provider
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+vlm_semaphore = asyncio.Semaphore(VLM_MAX_CONCURRENCY)
+
+# *Shared by every job, so a rate limit backs all of them off together
+llm_bucket = retry.TokenBucket(LLM_REQUESTS_PER_SECOND)
+vlm_bucket = retry.TokenBucket(VLM_REQUESTS_PER_SECOND)
+
+transport_retry_policy = retry.RetryPolicy(
+    LLM_RETRY_ATTEMPTS, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY
+)
+# *Unparseable responses are asked for again quickly, the provider is not struggling
+parse_retry_policy = retry.RetryPolicy(LLM_PARSE_ATTEMPTS, 0.25, 4)
 
-llm_client = OpenAI(base_url=LLM_API_BASE_URL, api_key=LLM_API_KEY)
-vlm_client = OpenAI(base_url=VLM_API_BASE_URL, api_key=VLM_API_KEY)
 
+if LLM_OUTPUT_FORMAT not in structured_output.OUTPUT_FORMATS:
+    raise ValueError("Invalid LLM_OUTPUT_FORMAT")
+
+# *Set by the app once the database is up (see use_response_cache)
+response_cache = None
+
+# *Model requests made since startup and the tokens they generated (see GET /stats)
+usage_counts = {"requests": 0, "output_tokens": 0}
+
+
+def record_usage(completion):
+    usage_counts["requests"] += 1
+    usage = getattr(completion, "usage", None)
+    if usage is not None and usage.completion_tokens is not None:
+        usage_counts["output_tokens"] += usage.completion_tokens
+
+
+def use_response_cache(cache):
+    global response_cache
+    response_cache = cache
+
+
+async def call_llm(prompt, use_cache=True, response_format=None, update_cache=True):
+    key_parts = [LLM_NAME, SYSTEM_PROMPT, prompt.strip()]
+    if response_format is not None:
+        key_parts.append(response_format)
+    key = cache_key(*key_parts)
+    if use_cache and response_cache is not None:
+        response = await response_cache.get(key)
+        if response is not None:
+            return response
+
+    options = {} if response_format is None else {"response_format": response_format}
+
+    async def request():
+        async with llm_semaphore:
+            return await llm_client.chat.completions.create(
+                model=LLM_NAME,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt.strip()},
+                ],
+                **options,
+            )
 
-def call_llm(prompt):
-    completion = llm_client.chat.completions.create(
-        model=LLM_NAME,
-        messages=[
-            {
-                "role": "system",
-                "content": "Always assist with care, respect, and truth. Respond with utmost utility yet securely. Avoid harmful, unethical, prejudiced, or negative content. Ensure replies promote fairness and positivity.",  # *https://www.promptingguide.ai/models/mixtral#system-prompt-to-enforce-guardrails
-            },
-            {"role": "user", "content": prompt.strip()},
-        ],
+    completion = await retry.call_with_retries(
+        request, transport_retry_policy, llm_bucket
     )
+    record_usage(completion)
     # printd(prompt.strip() + "," + completion.choices[0].message.content)
 
-    return completion.choices[0].message.content
-
-
-def call_vlm(prompt, b64_image, img_type="jpeg"):
-    completion = vlm_client.chat.completions.create(
-        model=VLM_NAME,
-        messages=[
-            {
-                "role": "system",
-                "content": "Always assist with care, respect, and truth. Respond with utmost utility yet securely. Avoid harmful, unethical, prejudiced, or negative content. Ensure replies promote fairness and positivity.",  # *https://www.promptingguide.ai/models/mixtral#system-prompt-to-enforce-guardrails
-            },
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt.strip()},
+    response = completion.choices[0].message.content
+    if update_cache and response_cache is not None:  # *replaces stale or bad entries
+        await response_cache.put(key, response)
+
+    return response
+
+
+async def call_vlm(
+    prompt, b64_image, img_type="jpeg", use_cache=True, update_cache=True
+):
+    key = cache_key(
+        VLM_NAME,
+        SYSTEM_PROMPT,
+        prompt.strip(),
+        img_type,
+        hashlib.sha256(b64_image.encode()).hexdigest(),
+    )
+    if use_cache and response_cache is not None:
+        response = await response_cache.get(key)
+        if response is not None:
+            return response
+
+    async def request():
+        async with vlm_semaphore:
+            return await vlm_client.chat.completions.create(
+                model=VLM_NAME,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/{img_type};base64,{b64_image}"
-                        },
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt.strip()},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/{img_type};base64,{b64_image}"
+                                },
+                            },
+                        ],
                     },
                 ],
-            },
-        ],
+            )
+
+    completion = await retry.call_with_retries(
+        request, transport_retry_policy, vlm_bucket
     )
+    record_usage(completion)
 
     # printd(prompt.strip() + "," + completion.choices[0].message.content)
 
-    return completion.choices[0].message.content
+    response = completion.choices[0].message.content
+    if update_cache and response_cache is not None:
+        await response_cache.put(key, response)
+
+    return response
+
+
+class LLMNode(AsyncNode):
+    """AsyncNode whose LLM calls go through the response cache on the first attempt.
+
+    Retries (e.g. after a response that failed to parse) always ask the model again.
+    Set use_cache = False on nodes that need fresh output every time; their
+    responses are then not stored either.
+
+    Failed requests are already retried by call_llm, so only the other errors
+    raised by exec_async (malformed responses) make the node retry, with a short
+    jittered backoff instead of `wait`.
+
+    Nodes put output_format() in their prompt and read the answer back with
+    call_llm_structured, which asks for and parses `output_fields` (see
+    structured_output.py) in the LLM_OUTPUT_FORMAT format.
+    """
+
+    use_cache = True
+    output_fields = {}
+
+    def __init__(self, max_retries=parse_retry_policy.max_attempts, wait=0):
+        super().__init__(max_retries=max_retries, wait=wait)
+
+    async def _exec(self, prep_res):
+        # *Same as AsyncNode._exec, but keeps cur_retry like the sync Node does
+        for self.cur_retry in range(self.max_retries):
+            self.repaired = False  # *set by call_llm_structured
+            try:
+                exec_res = await self.exec_async(prep_res)
+            except Exception as e:
+                if isinstance(e, APIError):
+                    return await self.exec_fallback_async(prep_res, e)
+
+                structured_output.record_parse("failed")
+                if self.cur_retry == self.max_retries - 1:
+                    return await self.exec_fallback_async(prep_res, e)
+
+                retry.record_retry("parse")
+                await asyncio.sleep(parse_retry_policy.delay(self.cur_retry))
+            else:
+                structured_output.record_parse("parsed")
+                if self.repaired:  # *only counted once the node accepted the answer
+                    structured_output.record_parse("repaired")
+                return exec_res
+
+    def output_format(self):
+        return structured_output.format_instructions(
+            self.output_fields, LLM_OUTPUT_FORMAT
+        )
+
+    async def call_llm(self, prompt, response_format=None):
+        return await call_llm(
+            prompt,
+            use_cache=self.use_cache and getattr(self, "cur_retry", 0) == 0,
+            response_format=response_format,
+            update_cache=self.use_cache,  # *retries still replace a bad entry
+        )
+
+    async def call_llm_structured(self, prompt):
+        response = await self.call_llm(
+            prompt,
+            structured_output.response_format(
+                self.output_fields, LLM_OUTPUT_FORMAT, type(self).__name__
+            ),
+        )
+        result, repaired = structured_output.parse_response(
+            response, self.output_fields, LLM_OUTPUT_FORMAT
+        )
+        self.repaired = self.repaired or repaired
+
+        return result
+
+
+async def close():
+    await http_client.aclose()
+    printd("LLM/VLM HTTP connection pool closed")
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import time
+
+import db
+from config import LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS
+
+"""
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key          TEXT PRIMARY KEY NOT NULL, -- sha256 of model, system prompt and prompt
+    response     TEXT NOT NULL,
+    created_at   REAL NOT NULL, -- unix time, for the TTL
+    last_used_at REAL NOT NULL -- unix time, for LRU eviction
+) WITHOUT ROWID;
+"""
+
+
+def cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class ResponseCache:
+    """Content-addressed store of model responses in the llm_cache table.
+
+    Entries expire after `ttl_seconds`, and the least recently used ones are
+    evicted once there are more than `max_entries`.
+    """
+
+    def __init__(
+        self,
+        pool,
+        ttl_seconds: int = LLM_CACHE_TTL_SECONDS,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+    ):
+        self.pool = pool
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str):
+        response = await self.pool.run(self.read, key)
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return response
+
+    async def put(self, key: str, response: str):
+        await self.pool.run(self.write, key, response)
+
+    async def stats(self):
+        entries = await self.pool.run(
+            db.execute_read_query, "SELECT COUNT(*) FROM llm_cache"
+        )
+
+        return {"hits": self.hits, "misses": self.misses, "entries": entries[0][0]}
+
+    def read(self, connection, key: str):
+        now = time.time()
+        result = db.execute_read_query(
+            connection,
+            "SELECT response FROM llm_cache WHERE key = ? AND created_at > ?",
+            (key, now - self.ttl_seconds),
+        )
+
+        if not result:
+            return None
+
+        db.execute_write_query(
+            connection,
+            "UPDATE llm_cache SET last_used_at = ? WHERE key = ?",
+            (now, key),
+        )
+        return result[0][0]
+
+    def write(self, connection, key: str, response: str):
+        now = time.time()
+        with db.transaction(connection):
+            db.execute_write_query(
+                connection,
+                """
+                INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_used_at)
+                VALUES (?, ?, ?, ?)
+                """,
+                (key, response, now, now),
+                commit=False,
+            )
+            db.execute_write_query(
+                connection,
+                "DELETE FROM llm_cache WHERE created_at <= ?",
+                (now - self.ttl_seconds,),
+                commit=False,
+            )
+            db.execute_write_query(
+                connection,
+                """
+                DELETE FROM llm_cache
+                WHERE key IN (
+                    SELECT key FROM llm_cache
+                    ORDER BY last_used_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+                commit=False,
+            )
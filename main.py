@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 
@@ -6,104 +7,48 @@ from contextlib import asynccontextmanager
 from uuid import uuid4
 
 from fastapi import FastAPI, File, Form, HTTPException, Path, Query, UploadFile
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, model_validator
 
 import concept_extraction
 import concepts
 import db
+import llm
+import llm_cache
+import migrations
 import notes
 import quizzes
+import retry
+import structured_output
+from config import PROCESSING_WORKERS, UPLOAD_DIR
+from jobs import JobQueue
 
 # * Context manager
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global connection
+    global pool, job_queue
 
-    connection = db.create_connection(
-        os.path.join(os.path.dirname(__file__), "db.sqlite")
-    )
+    pool = db.ConnectionPool(os.path.join(os.path.dirname(__file__), "db.sqlite"))
 
-    connection.execute("PRAGMA foreign_keys = ON")
+    await pool.run(migrations.migrate)
+    await asyncio.to_thread(concept_extraction.get_splitter)  # *loads the tokenizer
+    llm.use_response_cache(llm_cache.ResponseCache(pool))
 
-    # *Create notes tables
-    db.execute_write_query(
-        connection,
-        """
-        CREATE TABLE IF NOT EXISTS notes (
-            id TEXT PRIMARY KEY NOT NULL,
-            name TEXT NOT NULL,
-            content TEXT NOT NULL,
-            status TEXT NOT NULL
-        );
-        """,
-    )
+    upload_dir = os.path.join(os.path.dirname(__file__), UPLOAD_DIR)
+    os.makedirs(upload_dir, exist_ok=True)
 
-    # *Create concepts tables
-    db.execute_write_query(
-        connection,
-        """
-        CREATE TABLE IF NOT EXISTS concepts (
-            id TEXT PRIMARY KEY NOT NULL,
-            note_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            content TEXT NOT NULL,
-            FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE
-        );
-        """,
-    )
-    db.execute_write_query(
-        connection,
-        """
-        CREATE TABLE IF NOT EXISTS cards (
-            id INTEGER PRIMARY KEY NOT NULL,
-            concept_id TEXT NOT NULL,
-            state TEXT,
-            step INTEGER,
-            stability REAL,
-            difficulty REAL,
-            due TEXT,
-            last_review TEXT,
-            FOREIGN KEY(concept_id) REFERENCES concepts(id) ON DELETE CASCADE
-        );
-        """,
-    )
-    db.execute_write_query(
-        connection,
-        """
-        CREATE TABLE IF NOT EXISTS review_logs (
-            id         TEXT PRIMARY KEY NOT NULL,
-            card_id    INTEGER NOT NULL,
-            rating     INTEGER,
-            review_datetime TEXT,
-            review_duration TEXT,
-            FOREIGN KEY(card_id) REFERENCES cards(id) ON DELETE CASCADE
-        );
-        """,
-    )
-
-    # *Create quizzes tables
-    db.execute_write_query(
-        connection,
-        """
-        CREATE TABLE IF NOT EXISTS quizzes (
-            id          TEXT PRIMARY KEY NOT NULL,
-            name        TEXT NOT NULL,
-            status      TEXT NOT NULL,
-            questions   TEXT NOT NULL, -- JSON string array
-            answers     TEXT NOT NULL, -- JSON string array
-            concept_ids TEXT NOT NULL, -- JSON uuid (string) array
-            responses   TEXT DEFAULT NULL, -- JSON string array
-            grades      TEXT DEFAULT NULL, -- JSON integer array
-            feedback    TEXT DEFAULT NULL -- JSON string array
-        );
-        """,
-    )
+    job_queue = JobQueue(pool, PROCESSING_WORKERS, upload_dir)
+    await job_queue.start()
 
     yield  # *run app
 
-    connection.close()
+    await job_queue.stop()
+    await llm.close()
+    notes.close()
+
+    pool.close()
 
 
 # * App
@@ -121,7 +66,7 @@ class TextNoteIn(BaseModel):
 
 
 class StartQuizIn(BaseModel):
-    note_ids: list[str]
+    note_ids: list[str] = []  # *ignored in due_global mode
     concept_limit: int
     question_limit: int
     mode: str
@@ -139,57 +84,116 @@ class SubmitQuizIn(BaseModel):
     responses: list[str]
 
 
+# *Helpers
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+async def sse_stream(events):
+    try:
+        async for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    # *Raised once the response has started, e.g. by a submission that lost a race
+    except HTTPException as e:
+        yield f"event: error\ndata: {json.dumps({'detail': e.detail})}\n\n"
+
+
+async def spool_upload(file: UploadFile, path: str):
+    """Copies an upload to disk a chunk at a time, never holding all of it in memory."""
+    with open(path, "wb") as f:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            await asyncio.to_thread(f.write, chunk)
+
+
+async def check_quiz_submittable(quiz_id: str):
+    result = await pool.run(
+        db.execute_read_query,
+        "SELECT status FROM quizzes WHERE id = ?",
+        (quiz_id,),
+    )
+
+    if not result:
+        raise HTTPException(status_code=404, detail="Quiz not found")
+
+    if result[0][0] == "completed":
+        raise HTTPException(status_code=409, detail="Quiz has already been completed")
+
+
+def update_note(connection, note_id: str, name: str, content: str, chunk_count: int):
+    """Saves an edit unless a job holds the note, returning its status (None if not saved).
+
+    Edited content sends the note back to pending; reprocessing extracts the changed chunks.
+    """
+    cursor = connection.execute(
+        """
+        UPDATE notes
+        SET name = ?, content = ?, chunk_count = ?,
+            status = CASE WHEN content = ? THEN status ELSE 'pending' END
+        WHERE id = ? AND status NOT IN ('processing', 'ingesting')
+        RETURNING status
+        """,
+        (name, content, chunk_count, content, note_id),
+    )
+    row = cursor.fetchone()
+    connection.commit()
+
+    return None if row is None else row[0]
+
+
 # *Endpoints
 
 
-@app.post("/notes")
+@app.post("/notes", status_code=202)
 async def upload_notes(
     file: UploadFile = File(...),
     content_type: str = Form(...),
 ):
+    if content_type not in notes.CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid content_type")
+
     filename = file.filename.rsplit(".", 1)[0]
-    content_bytes = await file.read()
-    content = notes.process_file(content_bytes, filename, content_type)
 
+    # *Parsing and image description happen in the background (see GET /notes/{note_id})
     note_id = str(uuid4())
-    db.execute_write_query(
-        connection,
-        """
-        INSERT INTO notes (id, name, content, status)
-        VALUES (?, ?, ?, 'pending')
-        """,
-        (note_id, filename, content),
-    )
-    return {"note_id": note_id}
+    await spool_upload(file, job_queue.upload_path(note_id))
+    job_id = await job_queue.enqueue_upload(note_id, filename, content_type)
+
+    return {"note_id": note_id, "job_id": job_id}
 
 
 @app.post("/notes/text")
 async def upload_textual_notes(note: TextNoteIn):
     note_id = str(uuid4())
-    db.execute_write_query(
-        connection,
+    chunk_count = await concept_extraction.count_chunks(note.content)
+    await pool.run(
+        db.execute_write_query,
         """
-        INSERT INTO notes (id, name, content, status)
-        VALUES (?, ?, ?, 'pending')
+        INSERT INTO notes (id, name, content, chunk_count, status)
+        VALUES (?, ?, ?, ?, 'pending')
         """,
-        (note_id, note.name, note.content),
+        (note_id, note.name, note.content, chunk_count),
     )
     return {"note_id": note_id}
 
 
 @app.get("/notes")
 async def list_notes():
-    notes = db.execute_read_query(connection, "SELECT id, name, status FROM notes")
+    notes = await pool.run(
+        db.execute_read_query, "SELECT id, name, status, chunk_count FROM notes"
+    )
 
-    return [{"id": id, "name": name, "status": status} for id, name, status in notes]
+    return [
+        {"id": id, "name": name, "status": status, "chunk_count": chunk_count}
+        for id, name, status, chunk_count in notes
+    ]
 
 
 @app.get("/notes/{note_id}")
 async def get_note_by_id(note_id: str = Path(...)):
-    result = db.execute_read_query(
-        connection,
+    result = await pool.run(
+        db.execute_read_query,
         """
-        SELECT name, content, status 
+        SELECT name, content, status, chunk_count
         FROM notes
         WHERE id = ?
         """,
@@ -198,15 +202,69 @@ async def get_note_by_id(note_id: str = Path(...)):
 
     if not result:
         raise HTTPException(status_code=404, detail="Note not found")
-    name, content, status = result[0]
+    name, content, status, chunk_count = result[0]
+
+    latest_job = await pool.run(
+        db.execute_read_query,
+        """
+        SELECT id, kind, status, chunks_done, chunks_total, error
+        FROM jobs
+        WHERE note_id = ?
+        ORDER BY created_at DESC
+        LIMIT 1
+        """,
+        (note_id,),
+    )
+
+    job = None
+    if latest_job:
+        job_id, kind, job_status, done, total, error = latest_job[0]
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": job_status,
+            "done": done,
+            "total": total,
+            "error": error,
+        }
+
+    return {
+        "name": name,
+        "content": content,
+        "status": status,
+        "chunk_count": chunk_count,
+        "job": job,
+    }
+
+
+@app.put("/notes/{note_id}")
+async def update_note_by_id(note: TextNoteIn, note_id: str = Path(...)):
+    # *Split before touching the note, keeping the read and the guarded UPDATE close together
+    chunk_count = await concept_extraction.count_chunks(note.content)
+    exists = await pool.run(
+        db.execute_read_query,
+        "SELECT 1 FROM notes WHERE id = ?",
+        (note_id,),
+    )
+
+    if not exists:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    # *Checked by the UPDATE itself, since the note may be sent for processing meanwhile
+    status = await pool.run(update_note, note_id, note.name, note.content, chunk_count)
+    if status is None:
+        raise HTTPException(
+            status_code=409,
+            detail="Note is still being ingested or processed",
+        )
 
-    return {"name": name, "content": content, "status": status}
+    return {"note_id": note_id, "status": status}
 
 
 @app.delete("/notes/{note_id}")
 async def delete_note_by_id(note_id: str = Path(...)):
-    exists = db.execute_read_query(
-        connection,
+    exists = await pool.run(
+        db.execute_read_query,
         "SELECT 1 FROM notes WHERE id = ?",
         (note_id,),
     )
@@ -214,18 +272,18 @@ async def delete_note_by_id(note_id: str = Path(...)):
     if not exists:
         raise HTTPException(status_code=404, detail="Note not found")
 
-    db.execute_write_query(
-        connection,
+    await pool.run(
+        db.execute_write_query,
         "DELETE FROM notes WHERE id = ?",
         (note_id,),
     )
     return {"deleted": True}
 
 
-@app.post("/notes/{note_id}/process")
+@app.post("/notes/{note_id}/process", status_code=202)
 async def process_note_into_concept(note_id: str = Path(...)):
-    result = db.execute_read_query(
-        connection,
+    result = await pool.run(
+        db.execute_read_query,
         "SELECT status FROM notes WHERE id = ?",
         (note_id,),
     )
@@ -240,44 +298,27 @@ async def process_note_into_concept(note_id: str = Path(...)):
             detail="Note is already being processed or has been processed",
         )
 
-    db.execute_write_query(
-        connection,
-        """
-        UPDATE notes
-        SET status = 'processing'
-        WHERE id = ?
-        """,
-        (note_id,),
-    )
-
-    content = db.execute_read_query(
-        connection,
-        "SELECT content FROM notes WHERE id = ?",
-        (note_id,),
-    )[0][0]
-
-    extracted_concepts = concept_extraction.extract_concepts(content)
-
-    for name, content in extracted_concepts.items():
-        concepts.create_concept_card(connection, note_id, name, content)
+    if status in ["ingesting", "failed"]:
+        raise HTTPException(
+            status_code=409,
+            detail="Note is still being ingested or could not be ingested",
+        )
 
-    db.execute_write_query(
-        connection,
-        """
-        UPDATE notes
-        SET status = 'processed'
-        WHERE id = ?
-        """,
-        (note_id,),
-    )
+    # *None if the status changed since it was read, e.g. by a concurrent request
+    job_id = await job_queue.enqueue(note_id)
+    if job_id is None:
+        raise HTTPException(
+            status_code=409,
+            detail="Note is already being processed or has been processed",
+        )
 
-    return {"note_id": note_id, "concepts_generated": len(extracted_concepts)}
+    return {"note_id": note_id, "job_id": job_id}
 
 
 @app.get("/notes/{note_id}/concepts")
 async def get_concepts_by_note(note_id: str = Path(...)):
-    exists = db.execute_read_query(
-        connection,
+    exists = await pool.run(
+        db.execute_read_query,
         "SELECT 1 FROM notes WHERE id = ?",
         (note_id,),
     )
@@ -285,119 +326,114 @@ async def get_concepts_by_note(note_id: str = Path(...)):
     if not exists:
         raise HTTPException(status_code=404, detail="Note not found")
 
-    raw_concepts = db.execute_read_query(
-        connection,
-        "SELECT id, name, content FROM concepts WHERE note_id = ?",
-        (note_id,),
-    )
-
-    concepts = []
-    for id, name, content in raw_concepts:
-        card_id, state, step, stability, difficulty, due, last_review = (
-            db.execute_read_query(
-                connection,
-                """
-            SELECT id, state, step, stability, difficulty, due, last_review
-            FROM cards
-            WHERE concept_id = ?
-            """,
-                (id,),
-            )[0]
-        )
+    note_concepts = await pool.run(concepts.get_concepts_with_cards, [note_id])
 
-        srs_info = {
-            "id": card_id,
-            "state": state,
-            "step": step,
-            "stability": stability,
-            "difficulty": difficulty,
-            "due": due,
-            "last_review": last_review,
+    return [
+        {
+            "id": concept["id"],
+            "name": concept["name"],
+            "content": concept["content"],
+            "srs_info": concept["srs_info"],
         }
+        for concept in note_concepts
+    ]
 
-        concepts.append(
-            {"id": id, "name": name, "content": content, "srs_info": srs_info}
-        )
 
-    return concepts
+# *JOBS
 
 
-# *CONCEPTS
-
+@app.get("/jobs/{job_id}")
+async def get_job_by_id(job_id: str = Path(...)):
+    result = await pool.run(
+        db.execute_read_query,
+        """
+        SELECT note_id, kind, status, chunks_done, chunks_total, concepts_generated, error
+        FROM jobs
+        WHERE id = ?
+        """,
+        (job_id,),
+    )
 
-@app.get("/concepts")
-async def list_concepts():
-    raw_concepts = db.execute_read_query(
-        connection, "SELECT id, note_id, name FROM concepts"
+    if not result:
+        raise HTTPException(status_code=404, detail="Job not found")
+    note_id, kind, status, chunks_done, chunks_total, concepts_generated, error = (
+        result[0]
     )
 
-    concepts = []
-
-    for id, note_id, name in raw_concepts:
-        card_id, state, step, stability, difficulty, due, last_review = (
-            db.execute_read_query(
-                connection,
-                """
-            SELECT id, state, step, stability, difficulty, due, last_review
-            FROM cards
-            WHERE concept_id = ?
-            """,
-                (id,),
-            )[0]
-        )
+    return {
+        "note_id": note_id,
+        "kind": kind,
+        "status": status,
+        "chunks_done": chunks_done,
+        "chunks_total": chunks_total,
+        "concepts_generated": concepts_generated,
+        "error": error,
+    }
 
-        srs_info = {
-            "id": card_id,
-            "state": state,
-            "step": step,
-            "stability": stability,
-            "difficulty": difficulty,
-            "due": due,
-            "last_review": last_review,
-        }
 
-        concepts.append(
-            {"id": id, "note_id": note_id, "name": name, "srs_info": srs_info}
-        )
+# *CONCEPTS
+
 
-    return concepts
+@app.get("/concepts")
+async def list_concepts():
+    all_concepts = await pool.run(concepts.get_concepts_with_cards, None, False)
+
+    return [
+        {
+            "id": concept["id"],
+            "note_id": concept["note_id"],
+            "name": concept["name"],
+            "srs_info": concept["srs_info"],
+        }
+        for concept in all_concepts
+    ]
 
 
 @app.get("/concepts/{concept_id}")
 async def get_concept_by_id(concept_id: str = Path(...)):
-    result = db.execute_read_query(
-        connection,
-        "SELECT note_id, name, content FROM concepts WHERE id = ?",
-        (concept_id,),
-    )
+    concept = await pool.run(concepts.get_concept_with_card, concept_id)
 
-    if not result:
+    if concept is None:
         raise HTTPException(status_code=404, detail="Concept not found")
-    note_id, name, content = result[0]
-
-    card_id, state, step, stability, difficulty, due, last_review = (
-        db.execute_read_query(
-            connection,
-            """
-        SELECT id, state, step, stability, difficulty, due, last_review
-        FROM cards
-        WHERE concept_id = ?
-        """,
-            (concept_id,),
-        )[0]
-    )
 
-    srs_info = {
-        "id": card_id,
-        "state": state,
-        "step": step,
-        "stability": stability,
-        "difficulty": difficulty,
-        "due": due,
-        "last_review": last_review,
+    return {
+        "note_id": concept["note_id"],
+        "name": concept["name"],
+        "content": concept["content"],
+        "srs_info": concept["srs_info"],
     }
 
-    return {"note_id": note_id, "name": name, "content": content, "srs_info": srs_info}
+
+# *STATS
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "llm_cache": await llm.response_cache.stats(),
+        "retries": dict(retry.retry_counts),
+        "parsing": structured_output.parse_stats(),
+        "usage": dict(llm.usage_counts),
+    }
+
+
+# *REVIEWS
+
+
+@app.get("/reviews/due")
+async def list_due_reviews(limit: int = Query(20, ge=1)):
+    due_concepts = await pool.run(concepts.get_due_concepts, limit, False)
+
+    return [
+        {
+            "id": concept["id"],
+            "note_id": concept["note_id"],
+            "name": concept["name"],
+            "retrievability": concept["retrievability"],
+            "srs_info": concept["srs_info"],
+        }
+        for concept in due_concepts
+    ]
 
 
 # *QUIZZES
@@ -405,33 +441,34 @@ async def get_concept_by_id(concept_id: str = Path(...)):
 
 @app.get("/quizzes")
 async def list_quizzes():
-    raw_quiz_data = db.execute_read_query(
-        connection,
-        "SELECT id, name, status, questions, grades FROM quizzes",
+    raw_quiz_data = await pool.run(
+        db.execute_read_query,
+        """
+        SELECT quizzes.id, quizzes.name, quizzes.status,
+            COUNT(quiz_questions.position), SUM(quiz_questions.grade)
+        FROM quizzes
+        LEFT JOIN quiz_questions ON quiz_questions.quiz_id = quizzes.id
+        GROUP BY quizzes.id
+        ORDER BY quizzes.rowid
+        """,
     )
 
-    quiz_data = []
-    for id, name, status, questions, grades in raw_quiz_data:
-        questions_list = json.loads(questions)
-        grades_list = None if grades is None else json.loads(grades)
-
-        quiz_data.append(
-            {
-                "id": id,
-                "name": name,
-                "status": status,
-                "total_no_questions": len(questions_list),
-                "total_score": None if grades_list is None else sum(grades_list),
-            }
-        )
-
-    return quiz_data
+    return [
+        {
+            "id": id,
+            "name": name,
+            "status": status,
+            "total_no_questions": total_no_questions,
+            "total_score": total_score,  # *SUM is NULL until the quiz is graded
+        }
+        for id, name, status, total_no_questions, total_score in raw_quiz_data
+    ]
 
 
 @app.post("/quizzes")
 async def start_quiz(quiz_data: StartQuizIn):
-    return quizzes.create_quiz_from_note(
-        connection,
+    return await quizzes.create_quiz_from_note(
+        pool,
         quiz_data.note_ids,
         quiz_data.concept_limit,
         quiz_data.question_limit,
@@ -439,76 +476,96 @@ async def start_quiz(quiz_data: StartQuizIn):
     )
 
 
+@app.post("/quizzes/stream")
+async def start_quiz_stream(quiz_data: StartQuizIn):
+    concepts_dict, question_cids = await pool.run(
+        quizzes.select_quiz_concepts,
+        quiz_data.note_ids,
+        quiz_data.concept_limit,
+        quiz_data.question_limit,
+        quiz_data.mode,
+    )
+
+    return StreamingResponse(
+        sse_stream(quizzes.iter_quiz(pool, concepts_dict, question_cids)),
+        media_type="text/event-stream",
+    )
+
+
 @app.get("/quizzes/{quiz_id}")
 async def get_quiz_by_id(quiz_id: str = Path(...)):
-    result = db.execute_read_query(
-        connection,
-        "SELECT name, status, questions, concept_ids, responses, grades, feedback FROM quizzes WHERE id = ?",
+    result = await pool.run(
+        db.execute_read_query,
+        "SELECT name, status FROM quizzes WHERE id = ?",
         (quiz_id,),
     )
 
     if not result:
         raise HTTPException(status_code=404, detail="Quiz not found")
-    name, status, questions, concept_ids, responses, grades, feedback = result[0]
+    name, status = result[0]
 
-    questions_list = json.loads(questions)
-    concept_ids_list = json.loads(concept_ids)
-    responses_list = None if responses is None else json.loads(responses)
-    grades_list = None if grades is None else json.loads(grades)
-    feedback_list = None if grades is None else json.loads(feedback)
+    questions = await pool.run(
+        db.execute_read_query,
+        """
+        SELECT concept_id, question, response, grade, feedback
+        FROM quiz_questions
+        WHERE quiz_id = ?
+        ORDER BY position
+        """,
+        (quiz_id,),
+    )
 
     return {
         "name": name,
         "status": status,
-        "questions": list(
-            map(
-                lambda concept_id, question, response, grade, feedback: {
-                    "concept_id": concept_id,
-                    "question": question,
-                    "response": response,
-                    "grade": grade,
-                    "feedback": feedback,
-                },
-                concept_ids_list,
-                questions_list,
-                (
-                    responses_list
-                    if responses_list is not None
-                    else [None] * len(questions_list)
-                ),
-                (
-                    grades_list
-                    if grades_list is not None
-                    else [None] * len(questions_list)
-                ),
-                (
-                    feedback_list
-                    if feedback_list is not None
-                    else [None] * len(questions_list)
-                ),
-            )
+        "questions": [
+            {
+                "concept_id": concept_id,
+                "question": question,
+                "response": response,
+                "grade": grade,
+                "feedback": feedback,
+            }
+            for concept_id, question, response, grade, feedback in questions
+        ],
+        "total_no_questions": len(questions),
+        "total_score": (
+            None if status != "completed" else sum(q[3] for q in questions)
         ),
-        "total_no_questions": len(questions_list),
-        "total_score": None if grades_list is None else sum(grades_list),
     }
 
 
 @app.post("/quizzes/{quiz_id}/submit")
 async def submit_quiz(quiz_id: str = Path(...), submit_data: SubmitQuizIn = None):
-    result = db.execute_read_query(
-        connection,
-        "SELECT status FROM quizzes WHERE id = ?",
-        (quiz_id,),
+    await check_quiz_submittable(quiz_id)
+
+    return await quizzes.submit_quiz(
+        pool,
+        quiz_id,
+        submit_data.responses,
     )
 
-    if not result:
-        raise HTTPException(status_code=404, detail="Quiz not found")
 
-    if result[0][0] == "completed":
-        raise HTTPException(status_code=409, detail="Quiz has already been completed")
+@app.post("/quizzes/{quiz_id}/submit/stream")
+async def submit_quiz_stream(
+    quiz_id: str = Path(...), submit_data: SubmitQuizIn = None
+):
+    await check_quiz_submittable(quiz_id)
 
-    return quizzes.submit_quiz(
-        connection,
-        quiz_id,
-        submit_data.responses,
+    concept_ids_list, questions_list, answers_list = await pool.run(
+        quizzes.load_quiz_for_grading, quiz_id, submit_data.responses
+    )
+
+    return StreamingResponse(
+        sse_stream(
+            quizzes.iter_quiz_grades(
+                pool,
+                quiz_id,
+                concept_ids_list,
+                questions_list,
+                answers_list,
+                submit_data.responses,
+            )
+        ),
+        media_type="text/event-stream",
     )
@@ -0,0 +1,204 @@
+import db
+from debug import printd
+
+
+def normalise_card_timestamps(connection):
+    rows = connection.execute("SELECT id, due, last_review FROM cards").fetchall()
+    connection.executemany(
+        "UPDATE cards SET due = ?, last_review = ? WHERE id = ?",
+        [
+            (db.utc_timestamp(due), db.utc_timestamp(last_review), card_id)
+            for card_id, due, last_review in rows
+        ],
+    )
+
+
+# *Append-only: migration n (1-based) upgrades a database from schema version n - 1
+# *to n. Each one is either an SQL script or a function taking the connection, and
+# *runs in its own transaction together with the bump of PRAGMA user_version.
+MIGRATIONS = [
+    # *1: initial schema (IF NOT EXISTS so databases created before migrations adopt it)
+    """
+    CREATE TABLE IF NOT EXISTS notes (
+        id TEXT PRIMARY KEY NOT NULL,
+        name TEXT NOT NULL,
+        content TEXT NOT NULL,
+        status TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS concepts (
+        id TEXT PRIMARY KEY NOT NULL,
+        note_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        content TEXT NOT NULL,
+        FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE
+    );
+    CREATE TABLE IF NOT EXISTS cards (
+        id INTEGER PRIMARY KEY NOT NULL,
+        concept_id TEXT NOT NULL,
+        state TEXT,
+        step INTEGER,
+        stability REAL,
+        difficulty REAL,
+        due TEXT,
+        last_review TEXT,
+        FOREIGN KEY(concept_id) REFERENCES concepts(id) ON DELETE CASCADE
+    );
+    CREATE TABLE IF NOT EXISTS review_logs (
+        id         TEXT PRIMARY KEY NOT NULL,
+        card_id    INTEGER NOT NULL,
+        rating     INTEGER,
+        review_datetime TEXT,
+        review_duration TEXT,
+        FOREIGN KEY(card_id) REFERENCES cards(id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS quizzes (
+        id          TEXT PRIMARY KEY NOT NULL,
+        name        TEXT NOT NULL,
+        status      TEXT NOT NULL,
+        questions   TEXT NOT NULL, -- JSON string array
+        answers     TEXT NOT NULL, -- JSON string array
+        concept_ids TEXT NOT NULL, -- JSON uuid (string) array
+        responses   TEXT DEFAULT NULL, -- JSON string array
+        grades      TEXT DEFAULT NULL, -- JSON integer array
+        feedback    TEXT DEFAULT NULL -- JSON string array
+    );
+
+    CREATE TABLE IF NOT EXISTS jobs (
+        id                 TEXT PRIMARY KEY NOT NULL,
+        note_id            TEXT NOT NULL,
+        status             TEXT NOT NULL, -- queued|running|completed|failed
+        chunks_done        INTEGER NOT NULL DEFAULT 0,
+        chunks_total       INTEGER DEFAULT NULL,
+        concepts_generated INTEGER DEFAULT NULL,
+        error              TEXT DEFAULT NULL,
+        created_at         TEXT NOT NULL,
+        FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE
+    );
+    """,
+    # *2: indexes for foreign key lookups (also used by ON DELETE CASCADE) and hot filters
+    """
+    CREATE INDEX IF NOT EXISTS concepts_note_id_idx ON concepts(note_id);
+    CREATE INDEX IF NOT EXISTS cards_concept_id_idx ON cards(concept_id);
+    CREATE INDEX IF NOT EXISTS cards_due_idx ON cards(due);
+    CREATE INDEX IF NOT EXISTS review_logs_card_id_idx ON review_logs(card_id);
+    CREATE INDEX IF NOT EXISTS quizzes_status_idx ON quizzes(status);
+    CREATE INDEX IF NOT EXISTS jobs_note_id_status_idx ON jobs(note_id, status);
+    """,
+    # *3: one row per quiz question instead of parallel JSON arrays on quizzes
+    """
+    CREATE TABLE quiz_questions (
+        quiz_id    TEXT NOT NULL,
+        position   INTEGER NOT NULL,
+        concept_id TEXT NOT NULL,
+        question   TEXT NOT NULL,
+        answer     TEXT NOT NULL,
+        response   TEXT DEFAULT NULL,
+        grade      INTEGER DEFAULT NULL,
+        feedback   TEXT DEFAULT NULL,
+        PRIMARY KEY(quiz_id, position),
+        FOREIGN KEY(quiz_id) REFERENCES quizzes(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+
+    INSERT INTO quiz_questions
+        (quiz_id, position, concept_id, question, answer, response, grade, feedback)
+    SELECT
+        quizzes.id,
+        questions.key,
+        json_extract(quizzes.concept_ids, '$[' || questions.key || ']'),
+        questions.value,
+        json_extract(quizzes.answers, '$[' || questions.key || ']'),
+        json_extract(quizzes.responses, '$[' || questions.key || ']'),
+        json_extract(quizzes.grades, '$[' || questions.key || ']'),
+        json_extract(quizzes.feedback, '$[' || questions.key || ']')
+    FROM quizzes, json_each(quizzes.questions) AS questions;
+
+    CREATE TABLE quizzes_new (
+        id     TEXT PRIMARY KEY NOT NULL,
+        name   TEXT NOT NULL,
+        status TEXT NOT NULL
+    );
+    INSERT INTO quizzes_new (id, name, status) SELECT id, name, status FROM quizzes;
+    DROP TABLE quizzes;
+    ALTER TABLE quizzes_new RENAME TO quizzes;
+    CREATE INDEX quizzes_status_idx ON quizzes(status);
+    """,
+    # *4: cards carry their note so quiz selection filters, orders and limits in one index
+    """
+    ALTER TABLE cards ADD COLUMN note_id TEXT REFERENCES notes(id) ON DELETE CASCADE;
+    UPDATE cards
+    SET note_id = (SELECT note_id FROM concepts WHERE concepts.id = cards.concept_id);
+    CREATE INDEX cards_note_queue_idx ON cards(note_id, last_review, due, stability);
+    """,
+    # *5: due and last_review as fixed-width UTC text, so they can be compared in SQL
+    normalise_card_timestamps,
+    # *6: persistent cache of LLM responses (see llm_cache.py)
+    """
+    CREATE TABLE llm_cache (
+        key          TEXT PRIMARY KEY NOT NULL,
+        response     TEXT NOT NULL,
+        created_at   REAL NOT NULL,
+        last_used_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX llm_cache_created_at_idx ON llm_cache(created_at);
+    CREATE INDEX llm_cache_last_used_at_idx ON llm_cache(last_used_at);
+    """,
+    # *7: jobs also ingest uploads in the background
+    """
+    ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'process';
+    ALTER TABLE jobs ADD COLUMN source_type TEXT DEFAULT NULL;
+    """,
+    # *8: fingerprints of the chunks each note was last processed from (see concepts.py)
+    """
+    CREATE TABLE note_chunks (
+        note_id     TEXT NOT NULL,
+        position    INTEGER NOT NULL,
+        fingerprint TEXT NOT NULL,
+        concepts    TEXT NOT NULL,
+        PRIMARY KEY(note_id, position),
+        FOREIGN KEY(note_id) REFERENCES notes(id) ON DELETE CASCADE
+    ) WITHOUT ROWID;
+    """,
+    # *9: chunks each note splits into, counted when its content is written
+    """
+    ALTER TABLE notes ADD COLUMN chunk_count INTEGER DEFAULT NULL;
+    """,
+]
+
+
+def get_schema_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection):
+    """Brings the database up to the latest schema version, then enables foreign keys."""
+    # *Table rebuilds must not trigger cascades; this pragma is a no-op inside a transaction
+    connection.execute("PRAGMA foreign_keys = OFF")
+
+    schema_version = get_schema_version(connection)
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= schema_version:
+            continue
+
+        printd(f"Migrating database to schema version {version}")
+        try:
+            if callable(migration):
+                connection.execute("BEGIN")
+                migration(connection)
+            else:
+                connection.executescript(f"BEGIN;\n{migration}")
+            connection.execute(f"PRAGMA user_version = {version}")
+
+            violations = connection.execute("PRAGMA foreign_key_check").fetchall()
+            if violations:
+                raise RuntimeError(
+                    f"Migration {version} left foreign key violations: {violations[:5]}"
+                )
+
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+
+    connection.execute("PRAGMA foreign_keys = ON")
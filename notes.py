@@ -1,16 +1,33 @@
+import asyncio
 import base64
-from io import BytesIO
+import hashlib
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 import fitz
 from docx import Document
 from docx.oxml.ns import qn
 from pptx import Presentation
 
+from concurrency import as_completed_limited
+from config import (
+    PDF_PAGES_PER_TASK,
+    PDF_PROCESSES,
+    VLM_MAX_CONCURRENCY,
+    VLM_MIN_IMAGE_BYTES,
+    VLM_MIN_IMAGE_PIXELS,
+)
+from debug import printd
 from llm import call_vlm
 
+CONTENT_TYPES = ("txt", "png", "jpeg", "pptx", "docx", "pdf")
 
-def vlm_process_image(b64_image, img_type):
-    return call_vlm(
+
+async def vlm_process_image(b64_image, img_type):
+    return await call_vlm(
         """
 # MISSION
 You are given an image of school material (notes / slides / worksheet) as input_image.
@@ -43,46 +60,97 @@ Visual school artifacts combine dense text, structure (headings, lists), equatio
     )
 
 
-def process_file(
-    file: bytes, filename: str, content_type: str
-):  # txt/md, images, pptx, word, pdf
+class DocumentSegments:
+    """A document walked into text segments and image placeholders.
+
+    Identical images share one placeholder, and tiny (decorative) ones are
+    skipped. The images are only described afterwards, all at once, by render.
+    """
+
+    def __init__(self):
+        self.segments = []  # *("text", str) or ("image", sha256 of the blob)
+        self.images = {}  # *sha256 -> (blob, img_type), in order of appearance
+
+    def add_text(self, text: str):
+        self.segments.append(("text", text))
+
+    def add_image(self, blob: bytes, img_type: str, size=None):
+        if len(blob) < VLM_MIN_IMAGE_BYTES or (
+            size is not None and size[0] * size[1] < VLM_MIN_IMAGE_PIXELS
+        ):
+            printd(f"Skipping decorative {img_type} image ({len(blob)} bytes, {size})")
+            return None
+
+        digest = hashlib.sha256(blob).hexdigest()
+        if digest in self.images:
+            printd(f"Reusing placeholder of duplicate image {digest[:12]}")
+        else:
+            self.images[digest] = (blob, img_type)
+        self.segments.append(("image", digest))
+        return digest
+
+    def add_image_again(self, digest):
+        if digest is not None:
+            self.segments.append(("image", digest))
+
+    async def render(self, on_progress=None):
+        digests = list(self.images)
+        description_by_digest = {}
+        async for image_idx, description in as_completed_limited(
+            (
+                vlm_process_image(base64.b64encode(blob).decode("utf-8"), img_type)
+                for blob, img_type in self.images.values()
+            ),
+            VLM_MAX_CONCURRENCY,
+        ):
+            description_by_digest[digests[image_idx]] = description
+            if on_progress is not None:
+                on_progress(len(description_by_digest), len(digests))
+
+        return "".join(
+            (
+                value
+                if kind == "text"
+                else "\n===IMAGE START===\n"
+                + description_by_digest[value]
+                + "\n===IMAGE END===\n"
+            )
+            for kind, value in self.segments
+        )
+
+
+def image_size(image):
+    """Pixel size of a python-pptx/python-docx image, or None if its format is not understood."""
+    try:
+        if hasattr(image, "px_width"):
+            return image.px_width, image.px_height
+        return image.size
+    except Exception:
+        return None
+
+
+def collect_segments(path: str, content_type: str):  # pptx, word
+    document = DocumentSegments()
+
     match content_type:
-        case "txt":  # *applies for markdown obviously since its just txt
-            # To read a FastAPI SpooledTemporaryFile (which is the underlying file object of an UploadFile) as text, the recommended approach is to use io.TextIOWrapper for proper encoding handling.
-            return file.decode("utf-8")
-        case "png":
-            return vlm_process_image(base64.b64encode(file).decode("utf-8"), "png")
-        case "jpeg":
-            return vlm_process_image(base64.b64encode(file).decode("utf-8"), "jpeg")
         case "pptx":
-            slides = Presentation(BytesIO(file)).slides
-
-            slides_notes = ""
-            for slide in slides:
+            for slide in Presentation(path).slides:
                 for shape in slide.shapes:
                     if hasattr(shape, "text"):
-                        slides_notes += shape.text + "\n"
+                        document.add_text(shape.text + "\n")
                     if hasattr(shape, "image"):
-                        slides_notes += (
-                            "\n"
-                            + "===IMAGE START==="
-                            + vlm_process_image(
-                                base64.b64encode(shape.image.blob).decode("utf-8"),
-                                shape.image.content_type.replace("image/", ""),
-                            )
-                            + "===IMAGE END==="
-                            + "\n"
+                        document.add_image(
+                            shape.image.blob,
+                            shape.image.content_type.replace("image/", ""),
+                            image_size(shape.image),
                         )
-
-            return slides_notes
         case "docx":
-            doc = Document(BytesIO(file))
-            docx_notes = ""
+            doc = Document(path)
 
             for para in doc.paragraphs:
                 for run in para.runs:
                     if run.text:
-                        docx_notes += run.text
+                        document.add_text(run.text)
 
                     drawing_elems = run._element.findall(
                         ".//w:drawing", namespaces=run._element.nsmap
@@ -98,39 +166,154 @@ def process_file(
                         if blip is not None:
                             embed_rid = blip.get(qn("r:embed"))
                             image_part = doc.part.related_parts[embed_rid]
-
-                            blob = image_part.blob
-                            b64_blob = base64.b64encode(blob).decode("utf-8")
                             content_type = image_part.content_type  # e.g. image/png
 
-                            docx_notes += (
-                                "\n===IMAGE START===\n"
-                                + vlm_process_image(
-                                    b64_blob, content_type.replace("image/", "")
-                                )
-                                + "\n===IMAGE END===\n"
+                            document.add_image(
+                                image_part.blob,
+                                content_type.replace("image/", ""),
+                                image_size(image_part.image),
                             )
 
-                docx_notes += "\n"
+                document.add_text("\n")
+        case _:
+            raise ValueError("Invalid content_type")
+
+    return document
+
+
+# *PDF
+
+
+pdf_process_pool = None
+
+
+def get_pdf_process_pool():
+    global pdf_process_pool
+    if pdf_process_pool is None:
+        # *spawn, since forking a process with live threads and sockets is unsafe
+        pdf_process_pool = ProcessPoolExecutor(
+            max_workers=PDF_PROCESSES, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    return pdf_process_pool
 
-            return docx_notes
-        case "pdf":
-            doc = fitz.open("pdf", file)
-            pdf_notes = ""
-            for page in doc:
-                pdf_notes += page.get_text("text") + "\n"
 
-                for img_index, img in enumerate(page.get_images(full=True)):
-                    xref = img[0]
+def pdf_page_count(path: str):
+    with fitz.open(path, filetype="pdf") as doc:
+        return doc.page_count
+
+
+def extract_pdf_pages(path: str, start: int, stop: int):
+    """Text and image xrefs of pages [start, stop), plus the images they use.
+
+    Runs in a worker process, so it opens the file itself and returns plain data.
+    """
+    pages = []
+    images = {}  # *xref -> (blob, ext, (width, height))
+    with fitz.open(path, filetype="pdf") as doc:
+        for page_number in range(start, stop):
+            page = doc[page_number]
+            xrefs = [img[0] for img in page.get_images(full=True)]
+            for xref in xrefs:
+                if xref not in images:
                     base_image = doc.extract_image(xref)
-                    blob = base_image["image"]
-                    b64_blob = base64.b64encode(blob).decode("utf-8")
-                    ext = base_image["ext"]
-                    pdf_notes += (
-                        "\n===IMAGE START===\n"
-                        + vlm_process_image(b64_blob, ext)
-                        + "\n===IMAGE END===\n"
+                    images[xref] = (
+                        base_image["image"],
+                        base_image["ext"],
+                        (base_image["width"], base_image["height"]),
                     )
-            return pdf_notes
+
+            pages.append((page.get_text("text"), xrefs))
+
+    return pages, images
+
+
+async def collect_pdf_segments(path: str):
+    page_count = await asyncio.to_thread(pdf_page_count, path)
+    page_ranges = [
+        (start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ]
+
+    if len(page_ranges) <= 1:  # *not worth a round trip to the process pool
+        results = [
+            await asyncio.to_thread(extract_pdf_pages, path, start, stop)
+            for start, stop in page_ranges
+        ]
+    else:
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    get_pdf_process_pool(), extract_pdf_pages, path, start, stop
+                )
+                for start, stop in page_ranges
+            )
+        )
+
+    document = DocumentSegments()
+    xref_digests = {}  # *pages often share one image object
+    for pages, images in results:
+        for text, xrefs in pages:
+            document.add_text(text + "\n")
+
+            for xref in xrefs:
+                if xref in xref_digests:
+                    document.add_image_again(xref_digests[xref])
+                    continue
+
+                blob, ext, size = images[xref]
+                xref_digests[xref] = document.add_image(blob, ext, size)
+
+    return document
+
+
+def close():
+    if pdf_process_pool is not None:
+        pdf_process_pool.shutdown(cancel_futures=True)
+        printd("PDF process pool closed")
+
+
+# *Files
+
+
+@contextmanager
+def mapped_file(path: str):
+    """The file's bytes, memory-mapped instead of read into memory."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:  # *empty files cannot be mapped
+            yield b""
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def read_image_b64(path: str):
+    with mapped_file(path) as file:
+        return base64.b64encode(file).decode("utf-8")
+
+
+def read_text(path: str):
+    with mapped_file(path) as file:
+        return str(file, "utf-8")
+
+
+async def process_file(
+    path: str, filename: str, content_type: str, on_progress=None
+):  # txt/md, images, pptx, word, pdf
+    match content_type:
+        case "txt":  # *applies for markdown obviously since its just txt
+            return await asyncio.to_thread(read_text, path)
+        case "png" | "jpeg":
+            return await vlm_process_image(
+                await asyncio.to_thread(read_image_b64, path), content_type
+            )
+        case "pdf":
+            document = await collect_pdf_segments(path)
         case _:
-            raise ValueError("Invalid content_type")
+            # *Parsing is CPU-bound, so it runs off the event loop
+            document = await asyncio.to_thread(collect_segments, path, content_type)
+
+    # *The whole document is walked first, then its images are described concurrently
+    return await document.render(on_progress)
@@ -1,17 +1,23 @@
-import json
-from datetime import datetime
+import copy
+from datetime import datetime, timezone
 from math import floor
 from uuid import uuid4
 
-import yaml
 from fastapi import HTTPException
 from fsrs import Card, Rating
 from pocketflow import *
 
 import db
-from concepts import scheduler
+import structured_output
+from concepts import get_due_concepts, scheduler, srs_info_from_card_row
+from concurrency import as_completed_limited
+from config import (
+    LLM_OUTPUT_FORMAT,
+    QUIZ_GENERATION_CONCURRENCY,
+    QUIZ_GRADING_CONCURRENCY,
+)
 from debug import printd
-from llm import call_llm
+from llm import LLMNode
 
 # class StartQuizIn(BaseModel):
 #     note_ids: list[str]
@@ -29,23 +35,55 @@ from llm import call_llm
 
 
 # *QUIZ GENERATOR
-class GenerateQuizName(Node):
-    def prep(self, shared):
+QUESTION_ANSWER_LIST = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "question": structured_output.STRING,
+            "answer": structured_output.STRING,
+        },
+        "required": ["question", "answer"],
+        "additionalProperties": False,
+    },
+}
+# *The list's items are shown as an example, written in the format being asked for
+if LLM_OUTPUT_FORMAT == "yaml":
+    QUESTION_ANSWER_LIST_DESCRIPTION = (
+        "(list of objects)\n"
+        "    - question: question (ONE string)\n"
+        "      answer: answer and relevant information (ONE string)"
+    )
+else:
+    QUESTION_ANSWER_LIST_DESCRIPTION = (
+        "(list of objects)\n"
+        '    [{"question": question (ONE string), '
+        '"answer": answer and relevant information (ONE string)}]'
+    )
+
+
+class GenerateQuizName(LLMNode):
+    output_fields = {
+        "analysis": (
+            structured_output.STRING,
+            "detailed step-by-step analysis of the concept names (ONE string)",
+        ),
+        "quiz_name": (
+            structured_output.STRING,
+            "name of quiz (ONE string)",
+        ),
+    }
+
+    async def prep_async(self, shared):
         return self.params["concept_names"]
 
-    def exec(self, concept_names):
+    async def exec_async(self, concept_names):
         prompt = f"""
 Given names of concepts tested in a quiz: {concept_names}
 Analyse them and write a succinct name for the quiz that aptly describes the tested concepts. Ensure that the length of the quiz name does not exceed 7 words.
-Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
-```yaml
-analysis: detailed step-by-step analysis of the concept names (ONE string)
-quiz_name: name of quiz (ONE string)
-```
+{self.output_format()}
         """
-        resp = call_llm(prompt)
-        yaml_str = resp.split("```yaml")[1].split("```")[0].strip()
-        result = yaml.safe_load(yaml_str)
+        result = await self.call_llm_structured(prompt)
 
         assert isinstance(result, dict)
         assert "quiz_name" in result
@@ -55,19 +93,31 @@ quiz_name: name of quiz (ONE string)
 
         return result
 
-    def post(self, shared, prep_res, exec_res):
+    async def post_async(self, shared, prep_res, exec_res):
         shared["quiz_name"] = exec_res["quiz_name"]
 
 
-class GenerateQuestionsFromConcept(Node):
-    def prep(self, shared):
+class GenerateQuestionsFromConcept(LLMNode):
+    use_cache = False  # *a new quiz on the same concept should get new questions
+    output_fields = {
+        "analysis": (
+            structured_output.STRING,
+            "detailed step-by-step analysis of chunk (ONE string)",
+        ),
+        "questions_and_answers": (
+            QUESTION_ANSWER_LIST,
+            QUESTION_ANSWER_LIST_DESCRIPTION,
+        ),
+    }
+
+    async def prep_async(self, shared):
         name = self.params["name"]
         content = self.params["content"]
         count = self.params["count"]
 
         return name, content, count
 
-    def exec(self, inputs):
+    async def exec_async(self, inputs):
         name, content, count = inputs
         prompt = f"""
 Given concept "{name}" with content:
@@ -75,17 +125,9 @@ Given concept "{name}" with content:
 {content}
 ```
 Analyse the content and make {count} question-and-answer pairs. The questions need to test the answerer on the concept's content so that we can accurately acertain whether he/she understands the concept. The corresponding answers need to accurately and fully answer the question based on the given concept's content with all relevant information (e.g. alternative viewpoints, grading instructions, etc.) without compromising the intended solutions' accuracy for future graders.
-Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
-```yaml
-analysis: detailed step-by-step analysis of chunk (ONE string)
-questions_and_answers: (list of objects)
-    - question: question (ONE string)
-      answer: answer and relevant information (ONE string)
-```
+{self.output_format()}
         """
-        resp = call_llm(prompt)
-        yaml_str = resp.split("```yaml")[1].split("```")[0].strip()
-        result = yaml.safe_load(yaml_str)
+        result = await self.call_llm_structured(prompt)
 
         assert isinstance(result, dict)
         assert "analysis" in result
@@ -110,27 +152,40 @@ questions_and_answers: (list of objects)
 
         return result
 
-    def post(self, shared, prep_res, exec_res):
+    async def post_async(self, shared, prep_res, exec_res):
         shared["questions_and_answers"] = exec_res["questions_and_answers"]
 
 
-generate_quiz_name_node = GenerateQuizName(max_retries=60, wait=5)
+generate_quiz_name_node = GenerateQuizName()
 
-generate_questions_from_concept_node = GenerateQuestionsFromConcept(
-    max_retries=60, wait=5
-)
+generate_questions_from_concept_node = GenerateQuestionsFromConcept()
 
 
 # *QUIZ GRADER
-class GradeQuestion(Node):
-    def prep(self, shared):
+class GradeQuestion(LLMNode):
+    output_fields = {
+        "analysis": (
+            structured_output.STRING,
+            "detailed step-by-step analysis of the model answer and response (ONE string)",
+        ),
+        "feedback": (
+            structured_output.STRING,
+            "your comments as a grader (ONE string)",
+        ),
+        "grade": (
+            structured_output.INTEGER,
+            "the score you give (ONE integer between 1 and 4 inclusive)",
+        ),
+    }
+
+    async def prep_async(self, shared):
         question = self.params["question"]
         answer = self.params["answer"]
         response = self.params["response"]
 
         return question, answer, response
 
-    def exec(self, inputs):
+    async def exec_async(self, inputs):
         question, answer, response = inputs
         prompt = f"""
 Given quiz question: {question} with model answer:
@@ -149,16 +204,9 @@ Based on the analysis and feedback, grade the response on a scale of 1 to 4 base
 - 3 (Good): Correct with small issues / lack of elaboration
 - 4 (Easy): Fully correct and well-formed
 
-Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
-```yaml
-analysis: detailed step-by-step analysis of the model answer and response (ONE string)
-feedback: your comments as a grader (ONE string)
-grade: the score you give (ONE integer between 1 and 4 inclusive)
-```
+{self.output_format()}
         """
-        resp = call_llm(prompt)
-        yaml_str = resp.split("```yaml")[1].split("```")[0].strip()
-        result = yaml.safe_load(yaml_str)
+        result = await self.call_llm_structured(prompt)
 
         assert isinstance(result, dict)
         assert "feedback" in result
@@ -171,127 +219,186 @@ grade: the score you give (ONE integer between 1 and 4 inclusive)
 
         return result
 
-    def post(self, shared, prep_res, exec_res):
+    async def post_async(self, shared, prep_res, exec_res):
         shared["feedback"] = exec_res["feedback"]
         shared["grade"] = exec_res["grade"]
 
 
-grade_question_node = GradeQuestion(max_retries=60, wait=5)
+grade_question_node = GradeQuestion()
 
 
 # *Functions
-def create_quiz_from_note(connection, note_ids, concept_limit, question_limit, mode):
-    concepts = {}
+async def run_node(node, params):
+    node = copy.copy(node)  # *module-level nodes are shared by concurrent calls
+    node.set_params(params)
 
-    printd("Getting concepts from notes")
-    for note_id in note_ids:
-        printd(f"Getting concepts from note {note_id}")
-        raw_concepts = db.execute_read_query(
-            connection,
-            "SELECT id, name, content FROM concepts WHERE note_id = ?",
-            (note_id,),
-        )
+    shared = {}
+    await node.run_async(shared)
+    return shared
 
-        for id, name, content in raw_concepts:
-            card_id, state, step, stability, difficulty, due, last_review = (
-                db.execute_read_query(
-                    connection,
-                    """
-                SELECT id, state, step, stability, difficulty, due, last_review
-                FROM cards
-                WHERE concept_id = ?
-                """,
-                    (id,),
-                )[0]
-            )
 
-            srs_info = {
-                "id": card_id,
-                "step": step,
-                "stability": stability,
-                "difficulty": difficulty,
-                "due": due,
-                "last_review": last_review,
-            }
+QUIZ_MODE_FILTERS = {
+    "due_only": "cards.last_review IS NOT NULL AND cards.due <= :now",
+    "learning_only": "cards.last_review IS NOT NULL",
+    "new_only": "cards.last_review IS NULL",
+    "mixed": "1",
+}
+
 
-            match mode:
-                case "due_only":
-                    due_datetime = datetime.fromisoformat(due)
-                    if last_review is not None and due_datetime <= datetime.now():
-                        concepts[id] = {
-                            "name": name,
-                            "content": content,
-                            "srs_info": srs_info,
-                        }
-                case "learning_only":
-                    if last_review is not None:
-                        concepts[id] = {
-                            "name": name,
-                            "content": content,
-                            "srs_info": srs_info,
-                        }
-                case "new_only":
-                    if last_review is None:
-                        concepts[id] = {
-                            "name": name,
-                            "content": content,
-                            "srs_info": srs_info,
-                        }
-                case "mixed":
-                    concepts[id] = {
-                        "name": name,
-                        "content": content,
-                        "srs_info": srs_info,
-                    }
-                case _:
-                    raise ValueError("Invalid mode")
-
-    printd("Sorting concepts")
-    concepts = sorted(
-        concepts.items(),
-        key=lambda concept: (
-            0
-            if not concept[1]["srs_info"]["stability"]
-            else concept[1]["srs_info"]["stability"]
-        ),  # *Prioritises low stability for review
-    )[
-        :concept_limit
-    ]  # * Trim sorted concept list (or queue) to concept_limit
-
-    concepts_dict = dict(concepts)
+def select_note_concepts(connection, note_ids, concept_limit, mode):
+    if mode not in QUIZ_MODE_FILTERS:
+        raise ValueError("Invalid mode")
+
+    note_params = {f"note_{i}": note_id for i, note_id in enumerate(note_ids)}
+    rows = db.execute_read_query(
+        connection,
+        f"""
+        SELECT concepts.id, concepts.name, concepts.content,
+            cards.id, cards.state, cards.step, cards.stability, cards.difficulty,
+            cards.due, cards.last_review
+        FROM cards
+        JOIN concepts ON concepts.id = cards.concept_id
+        WHERE cards.note_id IN ({", ".join(f":{name}" for name in note_params)})
+            AND {QUIZ_MODE_FILTERS[mode]}
+        ORDER BY cards.stability -- prioritises low stability (new cards first) for review
+        LIMIT :concept_limit
+        """,
+        {
+            **note_params,
+            "now": db.utc_timestamp(datetime.now(timezone.utc)),
+            "concept_limit": concept_limit,
+        },
+    )
+
+    return [
+        {
+            "id": id,
+            "name": name,
+            "content": content,
+            "srs_info": srs_info_from_card_row(*card_row),
+        }
+        for id, name, content, *card_row in rows
+    ]
+
+
+def select_quiz_concepts(connection, note_ids, concept_limit, question_limit, mode):
+    if mode == "due_global":
+        printd("Selecting due concepts across all notes")
+        selected_concepts = get_due_concepts(connection, concept_limit)
+    else:
+        printd("Selecting concepts from notes")
+        selected_concepts = select_note_concepts(
+            connection, note_ids, concept_limit, mode
+        )
+
+    if not selected_concepts:
+        raise HTTPException(status_code=400, detail="No concepts match the mode")
+
+    concepts_dict = {
+        concept["id"]: {
+            "name": concept["name"],
+            "content": concept["content"],
+            "srs_info": concept["srs_info"],
+        }
+        for concept in selected_concepts
+    }
 
     question_cids = {}
 
     printd("Processing sorted concepts")
+    concept_ids = list(concepts_dict)
     no_questions = 0
     while no_questions < question_limit:
-        concept_idx = no_questions % concept_limit
-        if concepts[concept_idx][0] in question_cids:
-            question_cids[concepts[concept_idx][0]] += 1
+        concept_id = concept_ids[no_questions % len(concept_ids)]
+        if concept_id in question_cids:
+            question_cids[concept_id] += 1
         else:
-            question_cids[concepts[concept_idx][0]] = 1
+            question_cids[concept_id] = 1
         no_questions += 1
 
-    printd("Generating quiz name")
-    concept_names = [c["name"] for c in concepts_dict.values()]
+    return concepts_dict, question_cids
 
-    shared = {}
-    generate_quiz_name_node.set_params({"concept_names": concept_names})
-    generate_quiz_name_node.run(shared)
-    quiz_name = shared["quiz_name"]
 
-    printd("Generating questions")
-    cids_questions_and_answers = []
+def insert_quiz(connection, quiz_id, quiz_name, cids, questions, answers):
+    with db.transaction(connection):
+        db.execute_write_query(
+            connection,
+            """
+            INSERT INTO quizzes (id, name, status)
+            VALUES (?, ?, ?)
+            """,
+            (quiz_id, quiz_name, "active"),
+            commit=False,
+        )
+        db.execute_many_query(
+            connection,
+            """
+            INSERT INTO quiz_questions (quiz_id, position, concept_id, question, answer)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (quiz_id, position, cid, question, answer)
+                for position, (cid, question, answer) in enumerate(
+                    zip(cids, questions, answers)
+                )
+            ],
+            commit=False,
+        )
+
+
+async def iter_quiz(pool, concepts_dict, question_cids):
+    """Yields ("start" | "name" | "question" | "quiz", data) events while the quiz is generated.
+
+    Questions are yielded as soon as their concept's generation call finishes, with
+    their final position in the quiz as "index". The last event holds the full quiz.
+    """
+    quiz_id = str(uuid4())
+    yield "start", {"id": quiz_id, "total_no_questions": sum(question_cids.values())}
+
+    question_offsets = {}
+    no_questions = 0
     for question_cid, question_count in question_cids.items():
-        concept = concepts_dict[question_cid]
-        concept_name = concept["name"]
-        concept_content = concept["content"]
+        question_offsets[question_cid] = no_questions
+        no_questions += question_count
 
-        shared = {}
-        generate_questions_from_concept_node.set_params(
-            {"name": concept_name, "content": concept_content, "count": question_count}
-        )
-        generate_questions_from_concept_node.run(shared)
+    printd("Generating quiz name and questions")
+    concept_names = [c["name"] for c in concepts_dict.values()]
+    question_cids_list = list(question_cids)
+
+    quiz_name = None
+    questions_shared_by_cid = {}
+    async for call_idx, shared in as_completed_limited(
+        [run_node(generate_quiz_name_node, {"concept_names": concept_names})]
+        + [
+            run_node(
+                generate_questions_from_concept_node,
+                {
+                    "name": concepts_dict[question_cid]["name"],
+                    "content": concepts_dict[question_cid]["content"],
+                    "count": question_count,
+                },
+            )
+            for question_cid, question_count in question_cids.items()
+        ],
+        QUIZ_GENERATION_CONCURRENCY,
+    ):
+        if call_idx == 0:
+            quiz_name = shared["quiz_name"]
+            yield "name", {"name": quiz_name}
+            continue
+
+        question_cid = question_cids_list[call_idx - 1]
+        questions_shared_by_cid[question_cid] = shared
+        for qa_idx, qa_dict in enumerate(shared["questions_and_answers"]):
+            yield "question", {
+                "index": question_offsets[question_cid] + qa_idx,
+                "concept_id": question_cid,
+                "question": qa_dict["question"],
+            }
+
+    cids_questions_and_answers = []
+    for question_cid in question_cids:
+        shared = questions_shared_by_cid[question_cid]
 
         # result["questions_and_answers"] = [
         #     {y: z.strip() for y, z in x.items()}
@@ -313,25 +420,9 @@ def create_quiz_from_note(connection, note_ids, concept_limit, question_limit, m
     cids, questions, answers = zip(*cids_questions_and_answers)
 
     printd("Updating db")
-    quiz_id = str(uuid4())
-
-    db.execute_write_query(
-        connection,
-        """
-        INSERT INTO quizzes (id, name, status, questions, answers, concept_ids)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """,
-        (
-            quiz_id,
-            quiz_name,
-            "active",
-            json.dumps(questions),
-            json.dumps(answers),
-            json.dumps(cids),
-        ),
-    )
+    await pool.run(insert_quiz, quiz_id, quiz_name, cids, questions, answers)
 
-    return {
+    yield "quiz", {
         "id": quiz_id,
         "name": quiz_name,
         "questions": [
@@ -342,153 +433,246 @@ def create_quiz_from_note(connection, note_ids, concept_limit, question_limit, m
     }
 
 
-def submit_quiz(connection, quiz_id, responses):
-    questions, answers, concept_ids = db.execute_read_query(
+async def create_quiz_from_note(pool, note_ids, concept_limit, question_limit, mode):
+    concepts_dict, question_cids = await pool.run(
+        select_quiz_concepts, note_ids, concept_limit, question_limit, mode
+    )
+
+    async for event, data in iter_quiz(pool, concepts_dict, question_cids):
+        pass  # *the last event holds the full quiz
+
+    return data
+
+
+def load_quiz_for_grading(connection, quiz_id, responses):
+    rows = db.execute_read_query(
         connection,
-        "SELECT questions, answers, concept_ids FROM quizzes WHERE id = ?",
+        """
+        SELECT concept_id, question, answer
+        FROM quiz_questions
+        WHERE quiz_id = ?
+        ORDER BY position
+        """,
         (quiz_id,),
-    )[0]
+    )
 
-    questions_list = json.loads(questions)
-    answers_list = json.loads(questions)
-    concept_ids_list = json.loads(concept_ids)
+    concept_ids_list = [concept_id for concept_id, _, _ in rows]
+    questions_list = [question for _, question, _ in rows]
+    answers_list = [answer for _, _, answer in rows]
 
     if len(responses) != len(questions_list):
         raise HTTPException(
             status_code=400, detail="Number of responses must match number of questions"
         )
 
-    grades_list = []
-    feedback_list = []
+    return concept_ids_list, questions_list, answers_list
 
-    qarfg_tuples_by_cid = {}
 
-    for concept_id, question, answer, response in zip(
-        concept_ids_list, questions_list, answers_list, responses
-    ):
-        printd(f"Grading question {question}")
-        shared = {}
-        grade_question_node.set_params(
-            {"question": question, "answer": answer, "response": response}
+def save_quiz_grades(
+    connection, quiz_id, qarfg_tuples_by_cid, responses, grades_list, feedback_list
+):
+    """Reviews each tested concept's card and stores the graded quiz in one transaction.
+
+    The quiz is marked completed first, so of two concurrent submissions only one is saved,
+    and cards are read inside the transaction, so concurrent quizzes review them in turn.
+    """
+    with db.transaction(connection):
+        cursor = connection.execute(
+            "UPDATE quizzes SET status = 'completed' WHERE id = ? AND status != 'completed'",
+            (quiz_id,),
         )
-        grade_question_node.run(shared)
-        feedback = shared["feedback"]
-        grade = shared["grade"]
+        if cursor.rowcount == 0:
+            raise HTTPException(
+                status_code=409, detail="Quiz has already been completed"
+            )
 
-        grades_list.append(grade)
-        feedback_list.append(feedback)
+        printd(f"Updating concept cards")
+        card_updates = []
+        review_log_inserts = []
+        for cid, qarfg_tuples in qarfg_tuples_by_cid.items():
+            total_score = 0
+            for question, answer, response, feedback, grade in qarfg_tuples:
+                total_score += grade
+            ave_score_floored = floor(total_score / len(qarfg_tuples))
+
+            ave_score_floored_processed = {
+                1: Rating.Again,
+                2: Rating.Hard,
+                3: Rating.Good,
+                4: Rating.Easy,
+            }[ave_score_floored]
 
-        if concept_id in qarfg_tuples_by_cid:
-            qarfg_tuples_by_cid[concept_id].append(
-                (question, answer, response, feedback, grade)
+            card_id, state, step, stability, difficulty, due, last_review = (
+                db.execute_read_query(
+                    connection,
+                    """
+                SELECT id, state, step, stability, difficulty, due, last_review
+                FROM cards
+                WHERE concept_id = ?
+                """,
+                    (cid,),
+                )[0]
             )
-        else:
-            qarfg_tuples_by_cid[concept_id] = [
-                (
-                    question,
-                    answer,
-                    response,
-                    feedback,
-                    grade,
-                )
-            ]
 
-    printd(f"Updating concept cards")
-    for cid, qarfg_tuples in qarfg_tuples_by_cid.items():
-        total_score = 0
-        for question, answer, response, feedback, grade in qarfg_tuples:
-            total_score += grade
-        ave_score_floored = floor(total_score / len(qarfg_tuples))
-
-        ave_score_floored_processed = {
-            1: Rating.Again,
-            2: Rating.Hard,
-            3: Rating.Good,
-            4: Rating.Easy,
-        }[ave_score_floored]
-
-        card_id, state, step, stability, difficulty, due, last_review = (
-            db.execute_read_query(
-                connection,
-                """
-            SELECT id, state, step, stability, difficulty, due, last_review
-            FROM cards
-            WHERE concept_id = ?
-            """,
-                (cid,),
-            )[0]
-        )
+            srs_info = {
+                "card_id": card_id,
+                "state": state,
+                "step": step,
+                "stability": stability,
+                "difficulty": difficulty,
+                "due": due,
+                "last_review": last_review,
+            }
 
-        srs_info = {
-            "card_id": card_id,
-            "state": state,
-            "step": step,
-            "stability": stability,
-            "difficulty": difficulty,
-            "due": due,
-            "last_review": last_review,
-        }
+            concept_card = Card.from_dict(srs_info)
+            updated_concept_card, review_log = scheduler.review_card(
+                concept_card, ave_score_floored_processed
+            )
+            updated_concept_card_dict = updated_concept_card.to_dict()
+            review_log_dict = review_log.to_dict()
 
-        concept_card = Card.from_dict(srs_info)
-        updated_concept_card, review_log = scheduler.review_card(
-            concept_card, ave_score_floored_processed
-        )
-        updated_concept_card_dict = updated_concept_card.to_dict()
-        review_log_dict = review_log.to_dict()
+            card_updates.append(
+                (
+                    cid,
+                    updated_concept_card_dict["state"],
+                    updated_concept_card_dict["step"],
+                    updated_concept_card_dict["stability"],
+                    updated_concept_card_dict["difficulty"],
+                    db.utc_timestamp(updated_concept_card_dict["due"]),
+                    db.utc_timestamp(updated_concept_card_dict["last_review"]),
+                    card_id,
+                )
+            )
 
-        db.execute_write_query(
+            review_log_inserts.append(
+                (
+                    str(uuid4()),
+                    card_id,
+                    review_log_dict["rating"],
+                    review_log_dict["review_datetime"],
+                    review_log_dict["review_duration"],
+                )
+            )
+
+        printd("Updating quiz db data")
+        db.execute_many_query(
             connection,
             """
             UPDATE cards 
             SET concept_id = ?, state = ?, step = ?, stability = ?, difficulty = ?, due = ?, last_review = ?
             WHERE id = ?
             """,
-            (
-                cid,
-                updated_concept_card_dict["state"],
-                updated_concept_card_dict["step"],
-                updated_concept_card_dict["stability"],
-                updated_concept_card_dict["difficulty"],
-                updated_concept_card_dict["due"],
-                updated_concept_card_dict["last_review"],
-                card_id,
-            ),
+            card_updates,
+            commit=False,
         )
-
-        db.execute_write_query(
+        db.execute_many_query(
             connection,
             """
             INSERT INTO review_logs (id, card_id, rating, review_datetime, review_duration)
             VALUES (?, ?, ?, ?, ?)
             """,
-            (
-                str(uuid4()),
-                card_id,
-                review_log_dict["rating"],
-                review_log_dict["review_datetime"],
-                review_log_dict["review_duration"],
-            ),
+            review_log_inserts,
+            commit=False,
+        )
+        db.execute_many_query(
+            connection,
+            """
+            UPDATE quiz_questions
+            SET response = ?, grade = ?, feedback = ?
+            WHERE quiz_id = ? AND position = ?
+            """,
+            [
+                (response, grade, feedback, quiz_id, position)
+                for position, (response, grade, feedback) in enumerate(
+                    zip(responses, grades_list, feedback_list)
+                )
+            ],
+            commit=False,
         )
 
-    printd("Updating quiz db data")
-    db.execute_write_query(
-        connection,
-        """
-        UPDATE quizzes 
-        SET status = ?, responses = ?, grades = ?, feedback = ?
-        WHERE id = ?
-        """,
-        (
-            "completed",
-            json.dumps(responses),
-            json.dumps(grades_list),
-            json.dumps(feedback_list),
-            quiz_id,
-        ),
+
+async def iter_quiz_grades(
+    pool, quiz_id, concept_ids_list, questions_list, answers_list, responses
+):
+    """Yields ("grade" | "result", data) events while the quiz is graded.
+
+    Grades are yielded as soon as each one is ready, with the question's position in
+    the quiz as "index". Cards are updated once all of them are in.
+    """
+    grades_list = [None] * len(questions_list)
+    feedback_list = [None] * len(questions_list)
+
+    qarfg_tuples_by_cid = {}
+
+    printd(f"Grading {len(questions_list)} questions")
+    shared_list = [None] * len(questions_list)
+    async for question_idx, shared in as_completed_limited(
+        [
+            run_node(
+                grade_question_node,
+                {"question": question, "answer": answer, "response": response},
+            )
+            for question, answer, response in zip(
+                questions_list, answers_list, responses
+            )
+        ],
+        QUIZ_GRADING_CONCURRENCY,
+    ):
+        shared_list[question_idx] = shared
+        grades_list[question_idx] = shared["grade"]
+        feedback_list[question_idx] = shared["feedback"]
+
+        yield "grade", {
+            "index": question_idx,
+            "grade": shared["grade"],
+            "feedback": shared["feedback"],
+        }
+
+    for concept_id, question, answer, response, shared in zip(
+        concept_ids_list, questions_list, answers_list, responses, shared_list
+    ):
+        feedback = shared["feedback"]
+        grade = shared["grade"]
+
+        if concept_id in qarfg_tuples_by_cid:
+            qarfg_tuples_by_cid[concept_id].append(
+                (question, answer, response, feedback, grade)
+            )
+        else:
+            qarfg_tuples_by_cid[concept_id] = [
+                (
+                    question,
+                    answer,
+                    response,
+                    feedback,
+                    grade,
+                )
+            ]
+
+    await pool.run(
+        save_quiz_grades,
+        quiz_id,
+        qarfg_tuples_by_cid,
+        responses,
+        grades_list,
+        feedback_list,
     )
 
-    return {
+    yield "result", {
         "grades": grades_list,
         "feedback": feedback_list,
         "total_score": sum(grades_list),
     }
+
+
+async def submit_quiz(pool, quiz_id, responses):
+    concept_ids_list, questions_list, answers_list = await pool.run(
+        load_quiz_for_grading, quiz_id, responses
+    )
+
+    async for event, data in iter_quiz_grades(
+        pool, quiz_id, concept_ids_list, questions_list, answers_list, responses
+    ):
+        pass  # *the last event holds the grading result
+
+    return data
@@ -0,0 +1,146 @@
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from debug import printd
+
+RETRY_CAUSES = ("rate_limit", "timeout", "connection", "server_error", "parse")
+
+# *Retries made since startup, by cause (see GET /stats)
+retry_counts = dict.fromkeys(RETRY_CAUSES, 0)
+
+
+def record_retry(cause: str):
+    retry_counts[cause] += 1
+
+
+def transient_cause(e: Exception):
+    """Why a failed model request is worth retrying, or None if retrying will not help."""
+    match e:
+        case openai.RateLimitError():
+            return "rate_limit"
+        # *Before APIConnectionError, which it subclasses
+        case openai.APITimeoutError():
+            return "timeout"
+        case openai.APIConnectionError():
+            return "connection"
+        case openai.InternalServerError():
+            return "server_error"
+        case openai.APIStatusError(status_code=408):
+            return "timeout"
+
+    return None
+
+
+def retry_after(e: Exception):
+    """Seconds the server asked us to wait before retrying, if it said."""
+    if not isinstance(e, openai.APIStatusError):
+        return None
+    headers = e.response.headers
+
+    try:
+        return float(headers["retry-after-ms"]) / 1000
+    except (KeyError, ValueError):
+        pass
+
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:  # *Retry-After may also be an HTTP date
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return (retry_at - datetime.now(timezone.utc)).total_seconds()
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, capped at `max_delay` seconds."""
+
+    def __init__(self, max_attempts: int, base_delay: float, max_delay: float):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, server_delay=None):
+        """Seconds to wait after the given (zero-based) failed attempt.
+
+        A delay asked for by the server is honoured (up to max_delay) if it is longer.
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        if server_delay is None:
+            return backoff
+
+        return max(backoff, min(server_delay, self.max_delay))
+
+
+class TokenBucket:
+    """Spaces out the requests of every caller of one endpoint.
+
+    Hands out `rate` tokens per second (no limit if rate <= 0), and none at all
+    while paused, so that a rate limit hit by one caller backs everyone off.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:  # *callers are served in the order they arrive
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                if self.rate <= 0:
+                    return
+
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+async def call_with_retries(request, policy: RetryPolicy, bucket: TokenBucket):
+    """Awaits request() until it succeeds, backing off after transient failures.
+
+    Errors that are not transient, and the last transient one, are raised.
+    """
+    for attempt in range(policy.max_attempts):
+        await bucket.acquire()
+        try:
+            return await request()
+        except Exception as e:
+            cause = transient_cause(e)
+            if cause is None or attempt == policy.max_attempts - 1:
+                raise
+
+            delay = policy.delay(attempt, retry_after(e))
+            if cause == "rate_limit":
+                bucket.pause(delay)
+
+            record_retry(cause)
+            printd(f"Retrying model request in {delay:.1f}s after {e!r}")
+            await asyncio.sleep(delay)
@@ -0,0 +1,179 @@
+"""
+Nodes describe the fields they expect back as {name: (JSON schema, description)}.
+
+In "yaml" mode (the default) the model is asked for a fenced YAML block, and a
+block that does not load as YAML is repaired locally where possible. In
+"json_object" and "json_schema" mode the endpoint is asked (via response_format)
+for a JSON object, and in "json_schema" mode for one matching the fields' schema.
+"""
+
+import json
+import re
+import textwrap
+
+import yaml
+
+STRING = {"type": "string"}
+INTEGER = {"type": "integer"}
+STRING_LIST = {"type": "array", "items": STRING}
+
+OUTPUT_FORMATS = ("yaml", "json_object", "json_schema")
+
+# *Model responses parsed since startup (see GET /stats)
+parse_counts = {"parsed": 0, "repaired": 0, "failed": 0}
+
+
+def record_parse(outcome: str):
+    parse_counts[outcome] += 1
+
+
+def parse_stats():
+    attempts = parse_counts["parsed"] + parse_counts["failed"]
+    return {
+        **parse_counts,
+        "failure_rate": parse_counts["failed"] / attempts if attempts else 0.0,
+    }
+
+
+def format_instructions(fields: dict, output_format: str):
+    field_lines = "\n".join(
+        f"{name}: {description}" for name, (schema, description) in fields.items()
+    )
+
+    if output_format == "yaml":
+        return f"""Output in yaml (including starting "```yaml" and closing "```" at start and end of your response respectively):
+```yaml
+{field_lines}
+```"""
+
+    return f"""Output ONE JSON object with these keys, in this order:
+{field_lines}"""
+
+
+def response_format(fields: dict, output_format: str, name: str):
+    match output_format:
+        case "yaml":
+            return None
+        case "json_object":
+            return {"type": "json_object"}
+        case "json_schema":
+            return {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": name,
+                    "strict": True,
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            field_name: schema
+                            for field_name, (schema, description) in fields.items()
+                        },
+                        "required": list(fields),
+                        "additionalProperties": False,
+                    },
+                },
+            }
+        case _:
+            raise ValueError("Invalid output format")
+
+
+def parse_response(response: str, fields: dict, output_format: str):
+    """Returns the parsed answer, and whether it only parsed after being repaired."""
+    if output_format == "yaml":
+        return parse_yaml_response(response, fields)
+    return parse_json_response(response)
+
+
+def parse_json_response(response: str):
+    try:
+        return json.loads(response), False
+    except json.JSONDecodeError:
+        pass
+
+    # *Some endpoints still wrap the object in a code fence or prose
+    start, end = response.find("{"), response.rfind("}")
+    if start == -1 or end < start:
+        raise ValueError("Response has no JSON object")
+
+    return json.loads(response[start : end + 1]), True
+
+
+def yaml_block(response: str):
+    if "```yaml" in response:
+        response = response.split("```yaml", 1)[1]
+    elif "```" in response:  # *fence without (or with another) language tag
+        response = response.split("```", 1)[1].split("\n", 1)[-1]
+
+    return response.split("```", 1)[0].strip()
+
+
+def parse_yaml_response(response: str, fields: dict):
+    block = yaml_block(response)
+    try:
+        result = yaml.safe_load(block)
+        if isinstance(result, dict):
+            return result, False
+    except yaml.YAMLError:
+        pass
+
+    return repair_yaml(block, fields), True
+
+
+def repair_yaml(block: str, fields: dict):
+    """Reads the expected top-level fields out of YAML that does not load as a whole.
+
+    Models mostly break YAML by writing unquoted strings containing ": " or "#",
+    so string fields are taken verbatim up to the next expected field, and only
+    the other fields are loaded as YAML on their own.
+    """
+    field_pattern = re.compile(
+        rf"^({'|'.join(re.escape(name) for name in fields)})[ \t]*:", re.MULTILINE
+    )
+    matches = list(field_pattern.finditer(block))
+    if not matches:
+        raise ValueError("Response has none of the expected fields")
+
+    result = {}
+    for match, next_match in zip(matches, [*matches[1:], None]):
+        name = match.group(1)
+        raw = block[match.end() : None if next_match is None else next_match.start()]
+        schema, description = fields[name]
+
+        if schema is STRING:
+            result[name] = repair_yaml_string(raw)
+        elif schema is STRING_LIST:
+            result[name] = repair_yaml_list(raw)
+        else:
+            result[name] = yaml.safe_load(textwrap.dedent(raw.strip("\n")))
+
+    return result
+
+
+def repair_yaml_string(raw: str):
+    first_line, _, rest = raw.partition("\n")
+    first_line = first_line.strip()
+    if first_line in ("|", "|-", ">", ">-"):  # *block scalar
+        return textwrap.dedent(rest).strip()
+
+    value = "\n".join(
+        line for line in [first_line, textwrap.dedent(rest).strip()] if line
+    )
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        value = value[1:-1]
+
+    return value
+
+
+def repair_yaml_list(raw: str):
+    try:
+        value = yaml.safe_load(textwrap.dedent(raw.strip("\n")))
+        if isinstance(value, list) and all(isinstance(x, str) for x in value):
+            return value
+    except yaml.YAMLError:
+        pass
+
+    return [
+        line.strip()[1:].strip().strip("\"'")
+        for line in raw.splitlines()
+        if line.strip().startswith("-")
+    ]